@@ -1,15 +1,22 @@
 import argparse
-from memory.sqlite_actions import clear_all_messages, clear_messages_by_id
+from memory.sqlite_actions import clear_all_messages, clear_messages_by_id, clear_response_cache
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Clear messages from the database.")
     parser.add_argument("--context_id", type=str, default=None, help="Context ID to clear messages for (if omitted, clears all messages)")
+    parser.add_argument("--session_id", type=str, default=None, help="Only clear this session of the context (requires --context_id)")
+    parser.add_argument("--cache", action="store_true", help="Clear cached responses instead of messages")
     args = parser.parse_args()
 
-    if args.context_id:
-        print(f"Clearing messages for context_id: {args.context_id}...")
-        clear_messages_by_id(args.context_id)
-        print(f"Messages for context_id {args.context_id} cleared.")
+    if args.cache:
+        print("Clearing the response cache...")
+        clear_response_cache()
+        print("Response cache cleared.")
+    elif args.context_id:
+        scope = f"context_id {args.context_id}" + (f", session_id {args.session_id}" if args.session_id else "")
+        print(f"Clearing messages for {scope}...")
+        clear_messages_by_id(args.context_id, args.session_id)
+        print(f"Messages for {scope} cleared.")
     else:
         print("Clearing all messages from the database...")
         clear_all_messages()
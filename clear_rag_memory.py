@@ -1,23 +1,29 @@
 
 import os
-import sqlite3
+import shutil
 
-# Paths (adjust if needed)
-DB_PATH = os.path.join(os.path.dirname(__file__), "memory", "agent_memory.db")
-INDEX_PATH = os.path.join(os.path.dirname(__file__), "rag", "rag_index.faiss")
+from memory.sqlite_actions import clear_rag_manifest
 
-# Remove all vector data from SQLite
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
-cursor.execute("DELETE FROM vector_chunks;")
-cursor.execute("DELETE FROM processed_files;")
-conn.commit()
-conn.close()
-print("Cleared vector_chunks and processed_files tables.")
+# Paths (adjust if needed)
+RAG_DIR = os.path.join(os.path.dirname(__file__), "rag")
+CHROMA_DIR = os.path.join(RAG_DIR, ".chromadb")
+HASH_STORE = os.path.join(RAG_DIR, "processed_files.txt")
 
-# Remove the FAISS index file
-if os.path.exists(INDEX_PATH):
-    os.remove(INDEX_PATH)
-    print("Deleted FAISS index file.")
+# Remove the Chroma vector store
+if os.path.exists(CHROMA_DIR):
+    shutil.rmtree(CHROMA_DIR)
+    print("Deleted Chroma vector store.")
 else:
-    print("FAISS index file not found.")
+    print("Chroma vector store not found.")
+
+# Clear the processed files manifest so every file is ingested again
+try:
+    clear_rag_manifest()
+    print("Cleared processed files manifest.")
+except Exception as e:
+    print(f"Could not clear processed files manifest: {e}")
+
+# Manifest file of earlier versions
+if os.path.exists(HASH_STORE):
+    os.remove(HASH_STORE)
+    print("Deleted legacy processed files manifest.")
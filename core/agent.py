@@ -1,146 +1,344 @@
+import asyncio
 import json
 import os
-from memory.sqlite_actions import add_message, get_num_messages_by_id
-from parsers.create_prompt import create_system_prompt
+from memory.sqlite_actions import DEFAULT_SESSION_ID
+from memory.message_log import log_message, recent_messages
+from memory.summaries import get_session_summary
+from memory.episodic import recall
+from parsers.create_prompt import create_system_prompt, get_being_tools
 from parsers.parse_being_json import load_being_json
-from core.providers.open_router import open_router_provider
-from core.providers.google import google_gemini_provider
-from tools.handle_tool_call import is_tool_call, parse_tool_call, run_tool, run_tools_batch
+from core.providers.open_router import open_router_provider, open_router_provider_stream
+from core.providers.google import google_gemini_provider, google_gemini_provider_stream
+from core.providers.local import local_provider, local_provider_stream
+from core.provider_chain import call_with_fallback, stream_with_fallback, rejected_tools, supports_native_tools
+from core import response_cache
+from core.single_flight import bump_context_version
+from core.sessions import session_lock
+from core.context_builder import build_context, format_report, count_tokens, model_id_for, MESSAGE_OVERHEAD_TOKENS
+from tools.handle_tool_call import is_tool_call, parse_tool_call, run_tool_async, run_tools_batch_async, format_tool_call, normalize_tool_params
+from tools.tool_registry import get_tool_schemas
 from utils.enums import AI_Providers, Numbers, Role
 from utils.dates import now
+from utils import metrics
 
 MAX_ITERATIONS = int(os.getenv("MAX_ITERATIONS", 5))
 
-def call_model(model_provider, system_prompt, message, rag_context, previous_messages):
+# Send tool schemas through the providers' function calling APIs instead of the text protocol.
+# A being can override this with "nativeToolCalling" in its being file.
+NATIVE_TOOL_CALLING = os.getenv("NATIVE_TOOL_CALLING", "false").lower() == "true"
+
+# Tool calls start with this marker; streamed text from it onwards is held back from the client
+TOOL_CALL_MARKER = "FUNCTION:"
+
+# Sent after tool results; the results themselves are already in the history
+TOOL_CONTINUATION_MESSAGE = (
+    "Use the tool results above to either call the next necessary tool "
+    "or give the user your final answer."
+)
+
+async def call_model(model_provider, system_prompt, message, rag_context, previous_messages, tools=None):
+    """
+    Calls the specified AI model provider. Returns (content, native_tool_calls).
+    """
+    if model_provider == AI_Providers.OPENROUTER.value:
+        return await open_router_provider(system_prompt, message, rag_context, previous_messages, tools)
+    elif model_provider == AI_Providers.GOOGLE.value:
+        return await google_gemini_provider(system_prompt, message, previous_messages, tools)
+    elif model_provider == AI_Providers.LOCAL.value:
+        return await local_provider(system_prompt, message, previous_messages, tools)
+    else:
+        raise ValueError(f"Unsupported model provider specified: {model_provider}")
+
+def stream_model(model_provider, system_prompt, message, rag_context, previous_messages, tools=None):
     """
-    Calls the specified AI model provider.
+    Returns an async iterator of (text_delta, native_tool_calls) items from the specified AI model provider.
     """
     if model_provider == AI_Providers.OPENROUTER.value:
-        return open_router_provider(system_prompt, message, rag_context, previous_messages)
+        return open_router_provider_stream(system_prompt, message, rag_context, previous_messages, tools)
     elif model_provider == AI_Providers.GOOGLE.value:
-        return google_gemini_provider(system_prompt, message, previous_messages)
+        return google_gemini_provider_stream(system_prompt, message, previous_messages, tools)
+    elif model_provider == AI_Providers.LOCAL.value:
+        return local_provider_stream(system_prompt, message, previous_messages, tools)
     else:
         raise ValueError(f"Unsupported model provider specified: {model_provider}")
 
-def get_ai_response(being, rag_context, message):
+def _emittable_length(text):
+    """
+    Returns how much of the streamed text can be shown to the user.
+    Everything from a tool call marker onwards is withheld, as is a trailing
+    partial marker that may be completed by the next delta.
+    """
+    marker_index = text.find(TOOL_CALL_MARKER)
+    if marker_index != -1:
+        return marker_index
+    for size in range(min(len(TOOL_CALL_MARKER) - 1, len(text)), 0, -1):
+        if TOOL_CALL_MARKER.startswith(text[-size:]):
+            return len(text) - size
+    return len(text)
+
+def _tool_result_to_str(result):
+    return json.dumps(result, indent=2) if isinstance(result, (dict, list)) else str(result)
+
+def _use_native_tools(being):
+    native = being.get("nativeToolCalling")
+    return NATIVE_TOOL_CALLING if native is None else bool(native)
+
+async def _model_events(being, system_prompt, message, rag_context, previous_messages, stream, tools=None):
+    """
+    Runs one model call across the being's provider chain (retries, fallbacks, hedging).
+    In streaming mode yields token events as they arrive; always finishes with a
+    `response` event carrying the full text and any native tool calls.
+    """
+    if not stream:
+        ai_response, native_tool_calls = await call_with_fallback(
+            being,
+            lambda provider: call_model(provider, system_prompt, message, rag_context, previous_messages, tools),
+        )
+        yield {"type": "response", "content": ai_response, "tool_calls": native_tool_calls}
+        return
+
+    full_text = ""
+    emitted = 0
+    native_tool_calls = []
+    deltas = stream_with_fallback(
+        being,
+        lambda provider: stream_model(provider, system_prompt, message, rag_context, previous_messages, tools),
+    )
+    async for delta, delta_tool_calls in deltas:
+        if delta_tool_calls:
+            native_tool_calls.extend(delta_tool_calls)
+        full_text += delta
+        safe_length = _emittable_length(full_text)
+        if safe_length > emitted:
+            yield {"type": "token", "content": full_text[emitted:safe_length]}
+            emitted = safe_length
+
+    # No tool call followed, so release any text held back as a possible marker prefix
+    if TOOL_CALL_MARKER not in full_text and emitted < len(full_text):
+        yield {"type": "token", "content": full_text[emitted:]}
+
+    yield {"type": "response", "content": full_text.strip(), "tool_calls": native_tool_calls}
+
+async def _run_turn(being, rag_context, message, stream=False, session_id=DEFAULT_SESSION_ID):
     """
     Manages the conversation turn, supporting both single and parallel tool calls.
+    Turns of the same session run one at a time; different sessions run in parallel.
+    Yields events as the turn progresses:
+    - {"type": "context", "tokens": dict}               (prompt token breakdown)
+    - {"type": "token", "content": str}                 (streaming only)
+    - {"type": "tool_call", "name": str, "params": dict}
+    - {"type": "tool_result", "name": str, "result": str}
+    - {"type": "done", "response": str, "cached": bool}
     """
+    async with session_lock(being["contextId"], session_id):
+        async for event in _session_turn(being, rag_context, message, stream, session_id):
+            yield event
+
+async def _session_turn(being, rag_context, message, stream, session_id):
     context_id = being["contextId"]
-    
+
     if not message:
         raise ValueError("Message cannot be empty")
-    
+
     try:
         model_provider = being["modelProvider"]
         if not model_provider:
             raise ValueError("Model provider not specified in being.json")
+        model_id = model_id_for(model_provider)
 
         # Get previous messages from database for context
-        previous_messages = get_num_messages_by_id(context_id, Numbers.MAX_MESSAGES.value)
+        previous_messages = await recent_messages(context_id, Numbers.MAX_MESSAGES.value, session_id)
 
-        # Track messages for this conversation turn as list of tuples
-        conversation_messages = [
-            (msg, role, created_at) for *_, msg, role, created_at in previous_messages
+        # History as list of tuples, oldest first (the database returns the most recent rows newest first)
+        history = [
+            (msg, role, created_at) for *_, msg, role, created_at in reversed(previous_messages)
         ] if previous_messages else []
 
-        # Add current user message to database and to conversation
-        now_str = now()
-        add_message(context_id, message, Role.USER.value)
-        conversation_messages.append((message, Role.USER.value, now_str))
+        # Answer repeated questions from the response cache
+        cache_pending = None
+        if response_cache.RESPONSE_CACHE:
+            cached_response, cache_pending = await response_cache.lookup(being, rag_context, history, message)
+            if cached_response:
+                await log_message(context_id, message, Role.USER.value, session_id, count_tokens(message, model_id))
+                await log_message(context_id, cached_response, Role.ASSISTANT.value, session_id, count_tokens(cached_response, model_id))
+                if stream:
+                    yield {"type": "token", "content": cached_response}
+                yield {"type": "done", "response": cached_response, "cached": True}
+                return
+
+        # Tool schemas for native function calling; None means the text protocol.
+        # Chains with a model that rejected tools before go straight to the text protocol.
+        tool_schemas = get_tool_schemas(get_being_tools(being)) if _use_native_tools(being) and supports_native_tools(being) else None
+
+        # Running summary of messages older than the history window (see tasks/memory_maintenance.py)
+        # and older turns of this session relevant to the message (see memory/episodic.py)
+        summary, episodes = await asyncio.gather(
+            get_session_summary(context_id, session_id),
+            recall(context_id, message, session_id),
+        )
+
+        # Fit system prompt, summary, RAG facts, episodes, history and message into the token budget
+        context = build_context(being, rag_context, history, message, native_tools=bool(tool_schemas), summary=summary, episodes=episodes)
+        rag_context = context["rag_context"]
+        print(f"[CONTEXT] {format_report(context['report'])}")
+        yield {"type": "context", "tokens": context["report"]}
+
+        system_prompt = context["system_prompt"]
+        # The fitted summary, RAG facts and episodes are rendered into the system prompt
+        system_tokens = sum(context["report"][part] for part in ("system", "summary", "rag", "episodes"))
+
+        # Incremental turn state: every message is appended to the history exactly once,
+        # so each iteration only sends what the previous call has not seen yet
+        conversation_messages = list(context["history"])
+        history_tokens = context["report"]["history"]
+
+        def remember(msg, role):
+            nonlocal history_tokens
+            conversation_messages.append((msg, role, now()))
+            history_tokens += count_tokens(msg, model_id) + MESSAGE_OVERHEAD_TOKENS
+
+        # Add current user message to database; it joins the history once it has been sent
+        await log_message(context_id, message, Role.USER.value, session_id, count_tokens(message, model_id))
 
         # --- Main loop for handling tool calls ---
         current_message = message
         ai_response = None
         last_tool_call = None
         repeat_tool_count = 0
-        original_user_message = message
-        
-        # Initialize a list to store tool results for this turn
-        tool_results_history = []
+        turn_tokens = 0
+        used_tools = False
 
         for iteration in range(MAX_ITERATIONS):
-            system_prompt = create_system_prompt(rag_context, being)
-            ai_response = call_model(model_provider, system_prompt, current_message, rag_context, conversation_messages)
+            ai_response = None
+            native_tool_calls = []
+            while True:
+                sent_tokens = system_tokens + history_tokens + count_tokens(current_message, model_id) + MESSAGE_OVERHEAD_TOKENS
+                streamed = False
+                try:
+                    async for event in _model_events(being, system_prompt, current_message, rag_context, conversation_messages, stream, tool_schemas):
+                        if event["type"] == "response":
+                            ai_response = event["content"]
+                            native_tool_calls = event["tool_calls"]
+                        else:
+                            streamed = True
+                            yield event
+                    break
+                except Exception as e:
+                    # Models without function calling support reject the tools payload;
+                    # fall back to the text protocol for the rest of the turn. Any other
+                    # error (auth, quota, unknown model...) is the turn's real failure.
+                    if not tool_schemas or streamed or not rejected_tools(e):
+                        raise
+                    print(f"[WARNING] Native tool calling failed ({e}). Falling back to the text tool protocol.")
+                    tool_schemas = None
+                    system_prompt = create_system_prompt(rag_context, being, summary=context["summary"], episodes=context["episodes"])
+                    system_tokens = count_tokens(system_prompt, model_id)
+
+            turn_tokens += sent_tokens
+            metrics.observe("agent.tokens_per_iteration", sent_tokens)
+            print(f"[CONTEXT] iteration {iteration + 1}: {sent_tokens} tokens sent")
+
+            if native_tool_calls:
+                # Store native calls in the text protocol so history stays readable for every provider
+                rendered_calls = "\n".join(format_tool_call(name, params) for name, params in native_tool_calls)
+                ai_response = f"{ai_response}\n{rendered_calls}".strip()
 
             if not ai_response:
                 raise ValueError("Received empty response from AI provider")
 
-            now_str = now()
             # Log the raw assistant message (including tool calls) for full context
-            add_message(context_id, ai_response, Role.ASSISTANT.value)
-            conversation_messages.append((ai_response, Role.ASSISTANT.value, now_str))
+            await log_message(context_id, ai_response, Role.ASSISTANT.value, session_id, count_tokens(ai_response, model_id))
+            remember(current_message, Role.USER.value)
+            remember(ai_response, Role.ASSISTANT.value)
 
-            # Check for tool calls - this now returns a list or False
-            tool_calls = is_tool_call(ai_response)
+            # Prefer structured tool calls; fall back to parsing the text protocol
+            if native_tool_calls:
+                tool_calls = [(name, normalize_tool_params(name, params)) for name, params in native_tool_calls]
+            else:
+                tool_calls = is_tool_call(ai_response)
 
             if tool_calls:
+                used_tools = True
+
                 # Handle multiple tool calls (parallel execution)
                 if len(tool_calls) > 1:
                     print(f"[INFO] Processing {len(tool_calls)} tool calls in parallel")
-                    
+
+                    for tool_name, params in tool_calls:
+                        yield {"type": "tool_call", "name": tool_name, "params": params}
+
                     # Execute all tools in batch
-                    batch_results = run_tools_batch(tool_calls)
-                    
+                    batch_results = await run_tools_batch_async(tool_calls)
+
                     # Log all results
                     for i, (tool_name, params) in enumerate(tool_calls):
-                        result_str = json.dumps(batch_results[i], indent=2) if isinstance(batch_results[i], (dict, list)) else str(batch_results[i])
-                        now_str = now()
-                        add_message(context_id, result_str, Role.TOOL.value)
-                        conversation_messages.append((result_str, Role.TOOL.value, now_str))
-                        tool_results_history.append(result_str)
-                    
-                    # Create synthesis prompt
-                    all_tool_results = "\n".join(f"- {res}" for res in tool_results_history)
-                    current_message = (
-                        f"You completed the user's request: '{original_user_message}'.\n"
-                        f"Here are the results from all your tool calls:\n{all_tool_results}\n"
-                        "Please synthesize these results into a final, comprehensive answer for the user."
-                    )
-                    continue
-                
+                        result_str = _tool_result_to_str(batch_results[i])
+                        await log_message(context_id, result_str, Role.TOOL.value, session_id, count_tokens(result_str, model_id))
+                        remember(result_str, Role.TOOL.value)
+                        yield {"type": "tool_result", "name": tool_name, "result": result_str}
+
                 # Handle single tool call (backward compatibility)
                 else:
                     tool_name, params = tool_calls[0]
                     tool_call_signature = (tool_name, str(params))
-                    
+
                     if tool_call_signature == last_tool_call:
                         repeat_tool_count += 1
                     else:
                         repeat_tool_count = 1
                     last_tool_call = tool_call_signature
-                    
+
                     if repeat_tool_count > 2:
-                        current_message = "The requested tool has already been executed multiple times. Please clarify your next instruction."
+                        print(f"[WARNING] Tool '{tool_name}' repeated with the same params. Ending the turn.")
                         break
-                    
-                    tool_result_raw = run_tool(tool_name, params)
-                    
-                    if isinstance(tool_result_raw, (dict, list)):
-                        tool_result_str = json.dumps(tool_result_raw, indent=2)
-                    else:
-                        tool_result_str = str(tool_result_raw)
+
+                    yield {"type": "tool_call", "name": tool_name, "params": params}
+
+                    tool_result_raw = await run_tool_async(tool_name, params)
+                    tool_result_str = _tool_result_to_str(tool_result_raw)
 
                     # Add the tool result to the database and our history list
-                    now_str = now()
-                    add_message(context_id, tool_result_str, Role.TOOL.value)
-                    conversation_messages.append((tool_result_str, Role.TOOL.value, now_str))
-                    tool_results_history.append(tool_result_str)
-
-                    # Reconstruct the prompt with the FULL history of tool results
-                    all_tool_results = "\n".join(f"- {res}" for res in tool_results_history)
-                    current_message = (
-                        f"You are fulfilling a user's request. The original request was: '{original_user_message}'.\n"
-                        f"You have already executed one or more tools. Here are the results so far:\n{all_tool_results}\n"
-                        "Based on these results, please either call the next necessary tool or provide the final answer to the user."
-                    )
-                    continue
+                    await log_message(context_id, tool_result_str, Role.TOOL.value, session_id, count_tokens(tool_result_str, model_id))
+                    remember(tool_result_str, Role.TOOL.value)
+                    yield {"type": "tool_result", "name": tool_name, "result": tool_result_str}
+
+                # The results are already in the history; just ask the model to carry on
+                current_message = TOOL_CONTINUATION_MESSAGE
+                continue
             else:
                 # This is a final text response, so exit the loop
                 break
 
-        return ai_response
+        metrics.observe("agent.tokens_per_turn", turn_tokens)
+        metrics.observe("agent.iterations_per_turn", iteration + 1)
+
+        # Tool results (dice rolls, searches, the time...) are not reproducible, so those turns are never cached
+        if cache_pending and not used_tools:
+            await response_cache.store(cache_pending, ai_response)
+
+        yield {"type": "done", "response": ai_response, "cached": False}
 
     except Exception as e:
         print(f"AI Error: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+    finally:
+        # The conversation changed; new identical requests must not join older in-flight turns
+        bump_context_version(context_id, session_id)
+
+async def get_ai_response(being, rag_context, message, session_id=DEFAULT_SESSION_ID):
+    """
+    Runs a full conversation turn in the given session and returns the final response text.
+    SQLite access runs in worker threads so the event loop is never blocked.
+    """
+    ai_response = None
+    async for event in _run_turn(being, rag_context, message, session_id=session_id):
+        if event["type"] == "done":
+            ai_response = event["response"]
+    return ai_response
+
+def stream_ai_response(being, rag_context, message, session_id=DEFAULT_SESSION_ID):
+    """
+    Runs a full conversation turn, streaming assistant tokens and tool events
+    as they happen. Returns an async iterator of event dicts (see _run_turn).
+    """
+    return _run_turn(being, rag_context, message, stream=True, session_id=session_id)
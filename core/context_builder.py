@@ -0,0 +1,209 @@
+import os
+from functools import lru_cache
+
+import tiktoken
+
+from core.provider_chain import provider_chain
+from parsers.create_prompt import create_system_prompt
+from utils.enums import AI_Providers
+
+# ---------------------------
+# Config
+# ---------------------------
+
+# Default prompt budget in tokens; a being can override it with "contextTokenBudget"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 8000))
+# Per-model budgets: "gemini-2.0-flash=100000,moonshotai/kimi-k2:free=60000"
+MODEL_TOKEN_BUDGETS = {
+    model.strip(): int(budget)
+    for model, _, budget in (item.rpartition("=") for item in os.getenv("MODEL_TOKEN_BUDGETS", "").split(","))
+    if model.strip() and budget.strip().isdigit()
+}
+# The system prompt and current message are always sent; this orders the trimmable parts
+CONTEXT_PRIORITY = [part.strip() for part in os.getenv("CONTEXT_PRIORITY", "summary,rag,episodes,history").split(",") if part.strip()]
+# Single history items (e.g. large tool results) are truncated to this many tokens
+CONTEXT_MAX_ITEM_TOKENS = int(os.getenv("CONTEXT_MAX_ITEM_TOKENS", 1000))
+
+# Rough per-message overhead for role/formatting tokens in chat APIs
+MESSAGE_OVERHEAD_TOKENS = 4
+TRUNCATION_NOTE = "\n...[truncated]"
+
+_MODEL_ENV = {
+    AI_Providers.OPENROUTER.value: ("OPENROUTER_MODEL_ID", "moonshotai/kimi-k2:free"),
+    AI_Providers.GOOGLE.value: ("GOOGLE_MODEL_ID", "gemini-1.5-flash"),
+}
+
+# ---------------------------
+# Token counting
+# ---------------------------
+
+def model_id_for(model_provider):
+    env_name, default = _MODEL_ENV.get(model_provider, (None, model_provider))
+    return os.getenv(env_name, default) if env_name else default
+
+@lru_cache(maxsize=None)
+def _encoding_for(model_id):
+    try:
+        return tiktoken.encoding_for_model(model_id)
+    except KeyError:
+        # Non-OpenAI models: cl100k_base is a close enough approximation for budgeting
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text, model_id=None):
+    if not text:
+        return 0
+    return len(_encoding_for(model_id or "").encode(text, disallowed_special=()))
+
+def count_message_tokens(messages, model_id=None):
+    """Counts tokens for a list of (message, role, created_at) tuples."""
+    return sum(count_tokens(msg, model_id) + MESSAGE_OVERHEAD_TOKENS for msg, *_ in messages)
+
+def truncate_to_tokens(text, max_tokens, model_id=None):
+    encoding = _encoding_for(model_id or "")
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens]) + TRUNCATION_NOTE
+
+def token_budget(being):
+    """
+    Resolves the prompt budget: the being override, otherwise the smallest
+    per-model budget (or default) across its provider chain, since the same
+    context is sent to a fallback when the primary provider fails.
+    """
+    if being.get("contextTokenBudget"):
+        return int(being["contextTokenBudget"])
+    return min(MODEL_TOKEN_BUDGETS.get(model_id_for(provider), CONTEXT_TOKEN_BUDGET) for provider in provider_chain(being))
+
+# ---------------------------
+# Context assembly
+# ---------------------------
+
+def _fit_rag(rag_context, remaining, model_id):
+    """Keeps RAG lines in relevance order while they fit. Returns (text, tokens, kept, dropped)."""
+    lines = [line.strip() for line in (rag_context or "").split("\n") if line.strip()]
+    kept = []
+    used = 0
+    for line in lines:
+        # Lines are rendered as "- fact" bullets in the system prompt
+        cost = count_tokens(f"- {line}\n", model_id)
+        if used + cost > remaining:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept), used, len(kept), len(lines) - len(kept)
+
+def _fit_summary(summary, remaining, model_id):
+    """Keeps the newest summary lines that fit. Returns (text, tokens)."""
+    lines = [line for line in (summary or "").split("\n") if line.strip()]
+    kept = []
+    used = 0
+    for line in reversed(lines):
+        cost = count_tokens(f"{line}\n", model_id)
+        if used + cost > remaining:
+            break
+        kept.append(line)
+        used += cost
+    kept.reverse()
+    return "\n".join(kept), used
+
+def _fit_history(history, remaining, model_id):
+    """
+    Keeps the most recent messages that fit, dropping the oldest first.
+    Oversized items are truncated to CONTEXT_MAX_ITEM_TOKENS before fitting.
+    Returns (messages oldest first, tokens, truncated_count).
+    """
+    kept = []
+    used = 0
+    truncated = 0
+    for msg, role, created_at in reversed(history):
+        msg = msg or ""
+        if count_tokens(msg, model_id) > CONTEXT_MAX_ITEM_TOKENS:
+            msg = truncate_to_tokens(msg, CONTEXT_MAX_ITEM_TOKENS, model_id)
+            truncated += 1
+        cost = count_tokens(msg, model_id) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > remaining:
+            break
+        kept.append((msg, role, created_at))
+        used += cost
+    kept.reverse()
+    return kept, used, truncated
+
+def build_context(being, rag_context, history, message, native_tools=False, summary="", episodes=""):
+    """
+    Fits the system prompt, conversation summary, RAG facts, recalled episodes,
+    history and current message into the being's token budget. History must be
+    chronological (oldest first).
+
+    Returns a dict with the trimmed `rag_context`, `summary`, `episodes`, `history`
+    and the final `system_prompt`, plus a `report` with the token breakdown.
+    """
+    model_id = model_id_for(being["modelProvider"])
+    budget = token_budget(being)
+
+    system_tokens = count_tokens(create_system_prompt("", being, native_tools=native_tools), model_id)
+    message_tokens = count_tokens(message, model_id) + MESSAGE_OVERHEAD_TOKENS
+    remaining = max(0, budget - system_tokens - message_tokens)
+
+    fitted = {
+        "summary": ("", 0),
+        "rag": ("", 0, 0, 0),
+        "episodes": ("", 0, 0, 0),
+        "history": ([], 0, 0),
+    }
+    for part in CONTEXT_PRIORITY:
+        if part == "summary":
+            fitted["summary"] = _fit_summary(summary, remaining, model_id)
+            remaining -= fitted["summary"][1]
+        elif part == "rag":
+            fitted["rag"] = _fit_rag(rag_context, remaining, model_id)
+            remaining -= fitted["rag"][1]
+        elif part == "episodes":
+            # Episodes are relevance-ordered lines, fitted like RAG facts
+            fitted["episodes"] = _fit_rag(episodes, remaining, model_id)
+            remaining -= fitted["episodes"][1]
+        elif part == "history":
+            fitted["history"] = _fit_history(history, remaining, model_id)
+            remaining -= fitted["history"][1]
+
+    trimmed_summary, summary_tokens = fitted["summary"]
+    trimmed_rag, rag_tokens, rag_kept, rag_dropped = fitted["rag"]
+    trimmed_episodes, episode_tokens, episodes_kept, episodes_dropped = fitted["episodes"]
+    trimmed_history, history_tokens, truncated = fitted["history"]
+
+    report = {
+        "model": model_id,
+        "budget": budget,
+        "system": system_tokens,
+        "summary": summary_tokens,
+        "rag": rag_tokens,
+        "episodes": episode_tokens,
+        "history": history_tokens,
+        "message": message_tokens,
+        "total": system_tokens + summary_tokens + rag_tokens + episode_tokens + history_tokens + message_tokens,
+        "rag_lines_kept": rag_kept,
+        "rag_lines_dropped": rag_dropped,
+        "episodes_kept": episodes_kept,
+        "episodes_dropped": episodes_dropped,
+        "history_kept": len(trimmed_history),
+        "history_dropped": len(history) - len(trimmed_history),
+        "history_truncated": truncated,
+    }
+
+    return {
+        "system_prompt": create_system_prompt(trimmed_rag, being, native_tools=native_tools, summary=trimmed_summary, episodes=trimmed_episodes),
+        "rag_context": trimmed_rag,
+        "summary": trimmed_summary,
+        "episodes": trimmed_episodes,
+        "history": trimmed_history,
+        "report": report,
+    }
+
+def format_report(report):
+    return (
+        f"total={report['total']}/{report['budget']} "
+        f"(system={report['system']}, summary={report['summary']}, rag={report['rag']}, episodes={report['episodes']}, history={report['history']}, message={report['message']}); "
+        f"history kept {report['history_kept']}, dropped {report['history_dropped']}, truncated {report['history_truncated']}; "
+        f"rag lines kept {report['rag_lines_kept']}, dropped {report['rag_lines_dropped']}; "
+        f"episodes kept {report['episodes_kept']}, dropped {report['episodes_dropped']}"
+    )
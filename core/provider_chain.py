@@ -0,0 +1,178 @@
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict, deque
+
+from core.providers.errors import ProviderError
+
+# ---------------------------
+# Config
+# ---------------------------
+
+PROVIDER_MAX_RETRIES = int(os.getenv("PROVIDER_MAX_RETRIES", 2))  # retries per provider, after the first attempt
+PROVIDER_BACKOFF_BASE = float(os.getenv("PROVIDER_BACKOFF_BASE", 0.5))  # seconds
+PROVIDER_BACKOFF_MAX = float(os.getenv("PROVIDER_BACKOFF_MAX", 8))  # seconds
+
+PROVIDER_HEDGE = os.getenv("PROVIDER_HEDGE", "false").lower() == "true"
+# Fixed hedge delay in seconds; 0 means use the provider's observed p95 latency
+PROVIDER_HEDGE_DELAY = float(os.getenv("PROVIDER_HEDGE_DELAY", 0))
+PROVIDER_HEDGE_MIN_SAMPLES = int(os.getenv("PROVIDER_HEDGE_MIN_SAMPLES", 20))
+
+# Recent successful call latencies per provider, used for the p95 hedge delay
+_latencies = defaultdict(lambda: deque(maxlen=200))
+
+# (provider, model id) pairs whose model rejected the native tools payload;
+# chains containing one use the text protocol instead of paying a failed call per model call
+_tools_rejected = set()
+
+# ---------------------------
+# Helpers
+# ---------------------------
+
+def provider_chain(being):
+    """Returns the ordered providers to try: the being's modelProvider, then its fallbacks."""
+    chain = [being["modelProvider"]]
+    for provider in being.get("fallbackProviders") or []:
+        if provider and provider not in chain:
+            chain.append(provider)
+    return chain
+
+def is_retryable(error) -> bool:
+    if isinstance(error, ProviderError):
+        return error.retryable
+    return isinstance(error, asyncio.TimeoutError)
+
+def rejected_tools(error) -> bool:
+    """Whether the model refused the native tools payload (see ProviderError.tools_rejected)."""
+    return isinstance(error, ProviderError) and error.tools_rejected
+
+def _model_key(provider):
+    # Imported here: context_builder imports this module
+    from core.context_builder import model_id_for
+    return (provider, model_id_for(provider))
+
+def _remember_tools_rejection(provider):
+    key = _model_key(provider)
+    if key not in _tools_rejected:
+        _tools_rejected.add(key)
+        print(f"[PROVIDERS] {key[1]} ({provider}) does not support native tool calling; using the text tool protocol for it from now on.")
+
+def supports_native_tools(being) -> bool:
+    """False once any model in the being's chain has rejected the tools payload."""
+    return not any(_model_key(provider) in _tools_rejected for provider in provider_chain(being))
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(PROVIDER_BACKOFF_MAX, PROVIDER_BACKOFF_BASE * (2 ** attempt)))
+
+def p95_latency(provider):
+    samples = _latencies[provider]
+    if len(samples) < PROVIDER_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+def hedge_delay(provider):
+    """Seconds to wait before firing a hedged request, or None when hedging is off."""
+    if not PROVIDER_HEDGE:
+        return None
+    if PROVIDER_HEDGE_DELAY > 0:
+        return PROVIDER_HEDGE_DELAY
+    return p95_latency(provider)
+
+async def _timed_call(provider, call):
+    started = time.perf_counter()
+    result = await call(provider)
+    _latencies[provider].append(time.perf_counter() - started)
+    return result
+
+async def _hedged_call(provider, call):
+    """
+    Sends the request; if it has not answered after the hedge delay, sends a
+    second identical one and returns whichever succeeds first.
+    """
+    delay = hedge_delay(provider)
+    if delay is None:
+        return await _timed_call(provider, call)
+
+    tasks = {asyncio.ensure_future(_timed_call(provider, call))}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            print(f"[PROVIDERS] {provider} slower than {delay:.2f}s, sending hedged request")
+            tasks.add(asyncio.ensure_future(_timed_call(provider, call)))
+
+        last_error = None
+        pending = tasks
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+        raise last_error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+# ---------------------------
+# Public API
+# ---------------------------
+
+async def call_with_fallback(being, call):
+    """
+    Runs `call(provider)` across the being's provider chain.
+    Retryable errors are retried with jittered backoff; any other error, or
+    running out of retries, moves on to the next provider. A rejected tools
+    payload is raised right away so the caller can rerun the chain without tools.
+    """
+    last_error = None
+    for provider in provider_chain(being):
+        for attempt in range(PROVIDER_MAX_RETRIES + 1):
+            try:
+                return await _hedged_call(provider, call)
+            except Exception as e:
+                if rejected_tools(e):
+                    _remember_tools_rejection(provider)
+                    raise
+                last_error = e
+                if not is_retryable(e) or attempt == PROVIDER_MAX_RETRIES:
+                    break
+                delay = backoff_delay(attempt)
+                print(f"[PROVIDERS] {provider} failed ({e}); retry {attempt + 1}/{PROVIDER_MAX_RETRIES} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+        print(f"[PROVIDERS] {provider} gave up: {last_error}")
+    raise last_error
+
+async def stream_with_fallback(being, stream):
+    """
+    Streaming counterpart of call_with_fallback for `stream(provider)` async iterators.
+    Retries and fallbacks only happen before the first delta is yielded; once
+    text has reached the client an error is raised as-is, as is a rejected
+    tools payload. Streams are not hedged.
+    """
+    last_error = None
+    for provider in provider_chain(being):
+        for attempt in range(PROVIDER_MAX_RETRIES + 1):
+            started = False
+            try:
+                async for delta in stream(provider):
+                    started = True
+                    yield delta
+                return
+            except Exception as e:
+                if started:
+                    raise
+                if rejected_tools(e):
+                    _remember_tools_rejection(provider)
+                    raise
+                last_error = e
+                if not is_retryable(e) or attempt == PROVIDER_MAX_RETRIES:
+                    break
+                delay = backoff_delay(attempt)
+                print(f"[PROVIDERS] {provider} stream failed ({e}); retry {attempt + 1}/{PROVIDER_MAX_RETRIES} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+        print(f"[PROVIDERS] {provider} gave up: {last_error}")
+    raise last_error
@@ -0,0 +1,73 @@
+import os
+import httpx
+import google.generativeai as genai
+
+# ---------------------------
+# Config
+# ---------------------------
+
+PROVIDER_TIMEOUT = float(os.getenv("PROVIDER_TIMEOUT", 120))  # seconds to wait for a model response
+PROVIDER_CONNECT_TIMEOUT = float(os.getenv("PROVIDER_CONNECT_TIMEOUT", 10))
+PROVIDER_MAX_CONNECTIONS = int(os.getenv("PROVIDER_MAX_CONNECTIONS", 100))
+PROVIDER_MAX_KEEPALIVE = int(os.getenv("PROVIDER_MAX_KEEPALIVE", 20))
+PROVIDER_KEEPALIVE_EXPIRY = float(os.getenv("PROVIDER_KEEPALIVE_EXPIRY", 60))
+PROVIDER_HTTP2 = os.getenv("PROVIDER_HTTP2", "true").lower() == "true"
+
+# Process-wide clients, created on first use and closed in the FastAPI lifespan
+_http_client = None
+_gemini_api_key = None
+_gemini_models = {}
+
+def _http2_available():
+    """HTTP/2 in httpx needs the optional `h2` package."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Returns the shared keep-alive HTTP client used by HTTP based providers.
+    Reusing it avoids a new TCP+TLS handshake on every model call.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        use_http2 = PROVIDER_HTTP2 and _http2_available()
+        _http_client = httpx.AsyncClient(
+            http2=use_http2,
+            limits=httpx.Limits(
+                max_connections=PROVIDER_MAX_CONNECTIONS,
+                max_keepalive_connections=PROVIDER_MAX_KEEPALIVE,
+                keepalive_expiry=PROVIDER_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(PROVIDER_TIMEOUT, connect=PROVIDER_CONNECT_TIMEOUT),
+        )
+        print(f"[PROVIDERS] HTTP client pool created (http2={use_http2}, max_connections={PROVIDER_MAX_CONNECTIONS}, keepalive={PROVIDER_MAX_KEEPALIVE})")
+    return _http_client
+
+def get_gemini_model(api_key: str, model_id: str):
+    """
+    Returns a cached GenerativeModel. genai.configure only re-runs when the API key changes.
+    """
+    global _gemini_api_key
+    if api_key != _gemini_api_key:
+        genai.configure(api_key=api_key)
+        _gemini_api_key = api_key
+        _gemini_models.clear()
+
+    model = _gemini_models.get(model_id)
+    if model is None:
+        model = genai.GenerativeModel(model_id)
+        _gemini_models[model_id] = model
+    return model
+
+async def close_provider_clients():
+    """Closes pooled connections. Called on application shutdown."""
+    global _http_client, _gemini_api_key
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+        print("[PROVIDERS] HTTP client pool closed.")
+    _http_client = None
+    _gemini_api_key = None
+    _gemini_models.clear()
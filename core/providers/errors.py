@@ -0,0 +1,31 @@
+import re
+
+class ProviderError(ValueError):
+    """
+    Raised by model providers when a call fails.
+    Subclasses ValueError so existing handlers keep working; `retryable` marks
+    transient failures (rate limits, 5xx, timeouts) that are worth retrying,
+    `tools_rejected` a model refusing the native tools payload.
+    """
+
+    def __init__(self, message: str, retryable: bool = False, status_code: int = None, tools_rejected: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status_code = status_code
+        self.tools_rejected = tools_rejected
+
+# HTTP statuses that usually clear up on their own
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+def is_retryable_status(status_code) -> bool:
+    return status_code in RETRYABLE_STATUS_CODES or (status_code is not None and status_code >= 500)
+
+# Statuses and wording providers use when a model does not support function calling, e.g.
+# OpenRouter's 404 "No endpoints found that support tool use" or Gemini's 400
+# "Function calling is not enabled for models/..."
+TOOLS_REJECTION_STATUS_CODES = {400, 404, 422}
+TOOLS_REJECTION_PATTERN = re.compile(r"\btools?\b|tool[ _]use|tool[ _]choice|\bfunctions?\b|function[ _]call", re.IGNORECASE)
+
+def is_tools_rejection(status_code, message) -> bool:
+    """Whether a request sent with tools failed because of the tools rather than e.g. auth or quota."""
+    return status_code in TOOLS_REJECTION_STATUS_CODES and bool(TOOLS_REJECTION_PATTERN.search(message or ""))
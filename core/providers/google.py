@@ -1,15 +1,17 @@
+import asyncio
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from dotenv import load_dotenv
-import google.generativeai as genai
-
 load_dotenv()
 
+from core.providers.clients import get_gemini_model
+from core.providers.errors import ProviderError, is_retryable_status, is_tools_rejection
 from utils.enums import Role
 
-def google_gemini_provider(system_prompt, message, previous_messages=[]):
+def _start_chat(system_prompt, message, previous_messages):
+    """Validates config and returns a chat seeded with history plus the final message to send."""
     api_key = os.getenv("GOOGLE_API_KEY")
     model_id = os.getenv("GOOGLE_MODEL_ID", "gemini-1.5-flash")
 
@@ -18,35 +20,127 @@ def google_gemini_provider(system_prompt, message, previous_messages=[]):
     if not message:
         raise ValueError("Message cannot be empty")
 
-    # Configure the Gemini API
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel(model_id)
+    # Reuse the configured Gemini model instead of rebuilding it on every call
+    model = get_gemini_model(api_key, model_id)
+
+    history = []
+    # previous_messages is already chronological: oldest first
+    for msg, role, _ in previous_messages:
+        if msg and msg.strip():
+            gemini_role = "user" if role == Role.USER.value else "model"
+            history.append({
+                "role": gemini_role,
+                "parts": [{"text": msg.strip()}]
+            })
+
+    # Create chat with history
+    chat = model.start_chat(history=history)
+
+    # Prepare the current message with system prompt for first message
+    final_message = f"{system_prompt}\n\n{message}"
+
+    return chat, final_message
+
+def _gemini_schema(schema):
+    """
+    Converts a JSON schema from TOOL_REGISTRY to the subset Gemini accepts:
+    upper-case types, no `default`, and `items` on every array.
+    """
+    converted = {"type": str(schema.get("type", "string")).upper()}
+    if schema.get("description"):
+        converted["description"] = schema["description"]
+    if schema.get("enum"):
+        converted["enum"] = schema["enum"]
+    if schema.get("properties"):
+        converted["properties"] = {name: _gemini_schema(prop) for name, prop in schema["properties"].items()}
+        if schema.get("required"):
+            converted["required"] = schema["required"]
+    if converted["type"] == "ARRAY":
+        converted["items"] = _gemini_schema(schema.get("items", {"type": "string"}))
+    return converted
+
+def _gemini_tools(tools):
+    """Builds the `tools` argument for send_message from registry schemas."""
+    declarations = []
+    for schema in tools:
+        declaration = {"name": schema["name"], "description": schema.get("description", "")}
+        # Gemini rejects OBJECT parameters without properties, so omit them for no-arg tools
+        if schema.get("parameters", {}).get("properties"):
+            declaration["parameters"] = _gemini_schema(schema["parameters"])
+        declarations.append(declaration)
+    return [{"function_declarations": declarations}]
+
+def _split_parts(response):
+    """Returns (text, tool_calls) from a Gemini response or stream chunk."""
+    text = ""
+    tool_calls = []
+    for candidate in response.candidates[:1]:
+        for part in candidate.content.parts:
+            function_call = getattr(part, "function_call", None)
+            if function_call and function_call.name:
+                args = type(function_call).to_dict(function_call).get("args") or {}
+                tool_calls.append((function_call.name, args))
+            elif getattr(part, "text", None):
+                text += part.text
+    return text, tool_calls
+
+def _provider_error(error, tools=None):
+    """
+    Wraps a Gemini failure in a ProviderError. google.api_core exceptions carry
+    the HTTP status in `code` (e.g. ResourceExhausted -> 429).
+    """
+    code = getattr(error, "code", None)
+    status_code = code if isinstance(code, int) else None
+    retryable = is_retryable_status(status_code) or isinstance(error, (asyncio.TimeoutError, ConnectionError))
+    return ProviderError(
+        f"Failed to get response from Gemini: {str(error)}",
+        retryable=retryable,
+        status_code=status_code,
+        tools_rejected=bool(tools) and is_tools_rejection(status_code, str(error)),
+    )
+
+async def google_gemini_provider(system_prompt, message, previous_messages=[], tools=None):
+    """
+    Returns (content, tool_calls). tool_calls holds native function calls and is
+    only populated when tool schemas are passed in `tools`.
+    """
+    chat, final_message = _start_chat(system_prompt, message, previous_messages)
 
     try:
-        history = []
-        # Ensure chronological order: oldest first
-        for msg, role, _ in sorted(previous_messages, key=lambda x: x[2]):
-            if msg and msg.strip():
-                gemini_role = "user" if role == Role.USER.value else "model"
-                history.append({
-                    "role": gemini_role,
-                    "parts": [{"text": msg.strip()}]
-                })
-
-        # Create chat with history
-        chat = model.start_chat(history=history)
-
-        # Prepare the current message with system prompt for first message
-        final_message = f"{system_prompt}\n\n{message}"
-
-        # Send the final message and get response
-        response = chat.send_message(final_message)
-        
-        if not response or not response.text:
+        # Send the final message and await the response without blocking the event loop
+        response = await chat.send_message_async(final_message, tools=_gemini_tools(tools) if tools else None)
+
+        content, tool_calls = _split_parts(response) if response else ("", [])
+        if not content.strip() and not tool_calls:
             raise ValueError("Empty response from Gemini")
-            
-        return response.text.strip()
-        
+
+        return content.strip(), tool_calls
+
+    except Exception as e:
+        print(f"Error details: {str(e)}")
+        raise _provider_error(e, tools)
+
+async def google_gemini_provider_stream(system_prompt, message, previous_messages=[], tools=None):
+    """
+    Streams the Gemini completion as (text_delta, None) items, followed by a
+    final ("", tool_calls) item when the model made native function calls.
+    """
+    chat, final_message = _start_chat(system_prompt, message, previous_messages)
+
+    try:
+        response = await chat.send_message_async(final_message, stream=True, tools=_gemini_tools(tools) if tools else None)
+
+        tool_calls = []
+        async for chunk in response:
+            # Chunks without parts (finish/safety metadata) yield nothing
+            text, chunk_tool_calls = _split_parts(chunk)
+            tool_calls.extend(chunk_tool_calls)
+            if text:
+                yield text, None
+
+        if tool_calls:
+            yield "", tool_calls
+
     except Exception as e:
         print(f"Error details: {str(e)}")
-        raise ValueError(f"Failed to get response from Gemini: {str(e)}")
+        raise _provider_error(e, tools)
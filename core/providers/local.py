@@ -0,0 +1,224 @@
+"""
+Deterministic local model provider for offline development and load testing.
+
+Responses come from a script of regex rules (LOCAL_SCRIPT_PATH), e.g.
+
+    [
+        {"match": "(?i)roll", "response": "FUNCTION: generate_random_number PARAMS: {'min_val': 1, 'max_val': 6}"},
+        {"match": "(?i)coin", "response": "FUNCTION: flip_coin PARAMS: {}"},
+        {"match": ".*", "response": "{name} heard: {message}"}
+    ]
+
+Templates can use {message}, {name} and, after a tool ran, {tool_result}.
+When the latest history entry is a tool result the `after_tool` template of
+the matching rule (or LOCAL_AFTER_TOOL_TEMPLATE) is used, so tool loops end.
+
+Latency and throughput are simulated with LOCAL_LATENCY_MS, LOCAL_LATENCY_JITTER_MS,
+LOCAL_LATENCY_DISTRIBUTION (fixed, uniform, exponential, lognormal) and
+LOCAL_TOKENS_PER_SEC. Randomness is seeded from LOCAL_SEED and the prompt, so
+the same input always produces the same output and timing.
+
+Run `python -m core.providers.local --port 8001` to serve the same behaviour as
+an OpenAI-compatible /v1/chat/completions endpoint; point OPENROUTER_BASE_URL at
+it to exercise the real HTTP provider path.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+
+from utils.enums import Role
+
+# ---------------------------
+# Config
+# ---------------------------
+
+LOCAL_SCRIPT_PATH = os.getenv("LOCAL_SCRIPT_PATH", "")
+LOCAL_LATENCY_MS = float(os.getenv("LOCAL_LATENCY_MS", 0))
+LOCAL_LATENCY_JITTER_MS = float(os.getenv("LOCAL_LATENCY_JITTER_MS", 0))
+LOCAL_LATENCY_DISTRIBUTION = os.getenv("LOCAL_LATENCY_DISTRIBUTION", "fixed").lower()
+LOCAL_TOKENS_PER_SEC = float(os.getenv("LOCAL_TOKENS_PER_SEC", 0))  # 0 = emit instantly
+LOCAL_SEED = os.getenv("LOCAL_SEED", "jitter")
+LOCAL_AFTER_TOOL_TEMPLATE = os.getenv("LOCAL_AFTER_TOOL_TEMPLATE", "Here is what I found: {tool_result}")
+
+# Used when no script file is configured
+DEFAULT_RULES = [
+    {"match": r"(?i)\b(roll|dice|die)\b", "response": "FUNCTION: generate_random_number PARAMS: {'min_val': 1, 'max_val': 6}"},
+    {"match": r"(?i)\b(coin|flip)\b", "response": "FUNCTION: flip_coin PARAMS: {}"},
+    {"match": r"(?i)\b(time|date|today)\b", "response": "FUNCTION: get_current_datetime PARAMS: {}"},
+    {"match": r".*", "response": "{name} (local) received: {message}"},
+]
+
+_rules = None
+
+# ---------------------------
+# Helpers
+# ---------------------------
+
+def load_rules():
+    """Loads and compiles the response script once per process."""
+    global _rules
+    if _rules is None:
+        rules = DEFAULT_RULES
+        if LOCAL_SCRIPT_PATH:
+            with open(LOCAL_SCRIPT_PATH, "r", encoding="utf-8") as f:
+                rules = json.load(f)
+        _rules = [(re.compile(rule.get("match", ".*"), re.DOTALL), rule) for rule in rules]
+    return _rules
+
+def _character_name(system_prompt):
+    match = re.search(r"You are playing the role of: \*\*(.+?)\*\*", system_prompt or "")
+    return match.group(1) if match else "Assistant"
+
+def _rng(system_prompt, message, previous_messages):
+    """Seeds randomness from the input so identical requests behave identically."""
+    return random.Random(f"{LOCAL_SEED}:{len(previous_messages)}:{message}")
+
+def sample_latency(rng) -> float:
+    """Returns the simulated time-to-first-token in seconds."""
+    mean = LOCAL_LATENCY_MS
+    jitter = LOCAL_LATENCY_JITTER_MS
+    if mean <= 0:
+        return 0.0
+    if LOCAL_LATENCY_DISTRIBUTION == "uniform":
+        value = rng.uniform(mean - jitter, mean + jitter)
+    elif LOCAL_LATENCY_DISTRIBUTION == "exponential":
+        value = rng.expovariate(1.0 / mean)
+    elif LOCAL_LATENCY_DISTRIBUTION == "lognormal":
+        # Lognormal with the configured mean; jitter sets the spread (heavy right tail)
+        sigma = math.sqrt(math.log(1 + (jitter / mean) ** 2)) if jitter > 0 else 0.5
+        value = rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+    else:
+        value = mean
+    return max(0.0, value) / 1000
+
+def split_tokens(text):
+    """Splits text into word-ish tokens, keeping whitespace so joins are lossless."""
+    return re.findall(r"\S+\s*|\s+", text)
+
+def _render(template, values):
+    """Fills {placeholders} without str.format, since tool call templates contain literal braces."""
+    for key, value in values.items():
+        template = template.replace("{" + key + "}", value)
+    return template
+
+def local_completion(system_prompt, message, previous_messages=[]):
+    """Returns the scripted completion text for the given prompt."""
+    if not message:
+        raise ValueError("Message cannot be empty")
+
+    last_role = previous_messages[-1][1] if previous_messages else None
+    last_tool_result = previous_messages[-1][0] if last_role == Role.TOOL.value else None
+    values = {
+        "message": message,
+        "name": _character_name(system_prompt),
+        "tool_result": last_tool_result or "",
+    }
+
+    for pattern, rule in load_rules():
+        if not pattern.search(message):
+            continue
+        if last_tool_result is not None:
+            return _render(rule.get("after_tool", LOCAL_AFTER_TOOL_TEMPLATE), values)
+        return _render(rule["response"], values)
+
+    return _render(LOCAL_AFTER_TOOL_TEMPLATE, values) if last_tool_result is not None else message
+
+# ---------------------------
+# Provider API
+# ---------------------------
+
+async def local_provider(system_prompt, message, previous_messages=[], tools=None):
+    """
+    Returns (content, tool_calls). Scripted tool calls are plain text, so
+    tool_calls is always empty and the agent's text protocol picks them up.
+    """
+    rng = _rng(system_prompt, message, previous_messages)
+    content = local_completion(system_prompt, message, previous_messages)
+
+    delay = sample_latency(rng)
+    if LOCAL_TOKENS_PER_SEC > 0:
+        delay += len(split_tokens(content)) / LOCAL_TOKENS_PER_SEC
+    if delay:
+        await asyncio.sleep(delay)
+    return content, []
+
+async def local_provider_stream(system_prompt, message, previous_messages=[], tools=None):
+    """Streams the scripted completion as (text_delta, None) items."""
+    rng = _rng(system_prompt, message, previous_messages)
+    content = local_completion(system_prompt, message, previous_messages)
+
+    first_token_delay = sample_latency(rng)
+    if first_token_delay:
+        await asyncio.sleep(first_token_delay)
+
+    for index, token in enumerate(split_tokens(content)):
+        if index and LOCAL_TOKENS_PER_SEC > 0:
+            await asyncio.sleep(1 / LOCAL_TOKENS_PER_SEC)
+        yield token, None
+
+# ---------------------------
+# OpenAI-compatible HTTP stand-in
+# ---------------------------
+
+def _split_openai_messages(messages):
+    """Maps OpenAI chat messages to (system_prompt, message, previous_messages)."""
+    system_prompt = ""
+    history = []
+    for item in messages:
+        if item.get("role") == Role.SYSTEM.value and not system_prompt:
+            system_prompt = item.get("content") or ""
+        else:
+            history.append((item.get("content") or "", item.get("role"), ""))
+    message = history.pop()[0] if history else ""
+    return system_prompt, message, history
+
+def create_app():
+    from fastapi import FastAPI, HTTPException, Request
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        system_prompt, message, history = _split_openai_messages(body.get("messages", []))
+        if not message:
+            raise HTTPException(status_code=400, detail="Message cannot be empty")
+
+        model = body.get("model", "local")
+        completion_id = f"chatcmpl-local-{int(time.time() * 1000)}"
+
+        if not body.get("stream"):
+            content, _ = await local_provider(system_prompt, message, history)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": Role.ASSISTANT.value, "content": content}, "finish_reason": "stop"}],
+            }
+
+        async def event_stream():
+            async for token, _ in local_provider_stream(system_prompt, message, history):
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": token}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    return app
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the local mock model as an OpenAI-compatible API.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host address for the mock server.")
+    parser.add_argument("--port", type=int, default=8001, help="Port for the mock server.")
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(), host=args.host, port=args.port)
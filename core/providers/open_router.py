@@ -1,18 +1,31 @@
 import os
-import requests
+import asyncio
+import httpx
 import json
 
+from core.providers.clients import get_http_client, close_provider_clients
+from core.providers.errors import ProviderError, is_retryable_status, is_tools_rejection
 from utils.enums import Role
 
-def open_router_provider(system_prompt, message, rag, previous_messages=[]):
+# Point OPENROUTER_BASE_URL at any OpenAI-compatible server (e.g. the local mock provider)
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
+OPENROUTER_URL = f"{OPENROUTER_BASE_URL}/chat/completions"
+
+def _build_request(system_prompt, message, previous_messages, tools=None):
+    """Validates config and builds the (headers, payload) pair shared by both call styles."""
     model = os.getenv("OPENROUTER_MODEL_ID", "moonshotai/kimi-k2:free")
     api_key = os.getenv("OPENROUTER_API_KEY")
 
     messages = [{"role": Role.SYSTEM.value, "content": system_prompt}]
 
-    # Add previous messages to the array
-    for msg, role, created_at in reversed(previous_messages):
-        messages.append({"role": role, "content": msg})
+    # Add previous messages to the array (already chronological: oldest first)
+    for msg, role, created_at in previous_messages:
+        if tools and role == Role.TOOL.value:
+            # With native tools the API requires a tool_call_id on tool messages,
+            # which stored history does not have, so replay results as user turns
+            messages.append({"role": Role.USER.value, "content": f"Tool result:\n{msg}"})
+        else:
+            messages.append({"role": role, "content": msg})
 
     # Add the current user message
     messages.append({"role": Role.USER.value, "content": message})
@@ -23,49 +36,161 @@ def open_router_provider(system_prompt, message, rag, previous_messages=[]):
         raise ValueError("Message cannot be empty")
     if not model:
         raise ValueError("Model ID is not specified in environment variables or defaults")
-    
+
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+    payload = {
+        "model": model,
+        "messages": messages,
+    }
+    if tools:
+        payload["tools"] = [{"type": "function", "function": schema} for schema in tools]
+        payload["tool_choice"] = "auto"
+    return headers, payload
+
+def _parse_tool_calls(raw_tool_calls):
+    """Converts OpenAI-style tool_calls into [(tool_name, params), ...]."""
+    tool_calls = []
+    for raw in raw_tool_calls or []:
+        function = raw.get("function", {})
+        name = function.get("name")
+        if not name:
+            continue
+        try:
+            params = json.loads(function.get("arguments") or "{}")
+        except json.JSONDecodeError as e:
+            print(f"[ERROR] Failed to parse native tool call arguments for '{name}': {e}")
+            continue
+        tool_calls.append((name, params if isinstance(params, dict) else {}))
+    return tool_calls
+
+def _api_error(error, tools=None):
+    """Builds a ProviderError from an OpenRouter error body ({"code": 429, "message": ...})."""
+    code = error.get("code") if isinstance(error, dict) else None
+    status_code = code if isinstance(code, int) else None
+    return ProviderError(
+        f"API Error: {error}",
+        retryable=is_retryable_status(status_code),
+        status_code=status_code,
+        tools_rejected=bool(tools) and is_tools_rejection(status_code, str(error)),
+    )
+
+async def open_router_provider(system_prompt, message, rag, previous_messages=[], tools=None):
+    """
+    Returns (content, tool_calls). tool_calls holds native function calls and is
+    only populated when tool schemas are passed in `tools`.
+    """
+    headers, payload = _build_request(system_prompt, message, previous_messages, tools)
+
     try:
-        payload = {
-            "model": model,
-            "messages": messages,
-        }
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-            },
-            data=json.dumps(payload)
+        # Awaiting the request keeps the event loop free for other conversations;
+        # the shared client reuses keep-alive connections across calls
+        response = await get_http_client().post(
+            url=OPENROUTER_URL,
+            headers=headers,
+            content=json.dumps(payload)
         )
 
         try:
             response.raise_for_status()  # Raise an exception for HTTP errors
-        except requests.exceptions.HTTPError as e:
-            raise ValueError(f"Failed to get response from OpenRouter: {str(e)}")
+        except httpx.HTTPStatusError as e:
+            raise ProviderError(
+                f"Failed to get response from OpenRouter: {str(e)}",
+                retryable=is_retryable_status(response.status_code),
+                status_code=response.status_code,
+                tools_rejected=bool(tools) and is_tools_rejection(response.status_code, response.text),
+            )
 
         response_data = response.json()
 
         if "error" in response_data:
-            raise ValueError(f"API Error: {response_data['error']}")
+            raise _api_error(response_data["error"], tools)
 
-        content = response_data.get("choices", [{}])[0].get("message", {}).get("content")
-        if not content:
-            raise ValueError(f"Invalid API Response: {response_data}")
+        response_message = response_data.get("choices", [{}])[0].get("message", {})
+        content = response_message.get("content") or ""
+        tool_calls = _parse_tool_calls(response_message.get("tool_calls"))
+        if not content and not tool_calls:
+            # Free-tier models occasionally return an empty choice; another attempt usually works
+            raise ProviderError(f"Invalid API Response: {response_data}", retryable=True)
 
-        return content
+        return content, tool_calls
 
-    except requests.exceptions.RequestException as e:
+    except httpx.RequestError as e:
+        # Connection failures and timeouts are transient
         print(f"Request failed: {str(e)}")
-        raise ValueError(f"Failed to get response from OpenRouter: {str(e)}")
+        raise ProviderError(f"Failed to get response from OpenRouter: {str(e)}", retryable=True)
     except json.JSONDecodeError as e:
         print(f"Invalid JSON response: {response.text}")
-        raise ValueError("Invalid response from OpenRouter")
+        raise ProviderError("Invalid response from OpenRouter", retryable=True)
     except Exception as e:
         print(f"Unexpected error: {str(e)}")
         raise
 
+async def open_router_provider_stream(system_prompt, message, rag, previous_messages=[], tools=None):
+    """
+    Streams the completion from OpenRouter as (text_delta, None) items, followed
+    by a final ("", tool_calls) item when the model made native tool calls.
+    OpenRouter uses OpenAI-style SSE: `data: {...}` lines terminated by `data: [DONE]`.
+    """
+    headers, payload = _build_request(system_prompt, message, previous_messages, tools)
+    payload["stream"] = True
+    # Tool call deltas arrive in fragments keyed by index; arguments are concatenated
+    partial_tool_calls = {}
+
+    try:
+        async with get_http_client().stream("POST", OPENROUTER_URL, headers=headers, content=json.dumps(payload)) as response:
+            if response.status_code >= 400:
+                body = await response.aread()
+                body = body.decode(errors='replace')
+                raise ProviderError(
+                    f"Failed to get response from OpenRouter: HTTP {response.status_code} {body}",
+                    retryable=is_retryable_status(response.status_code),
+                    status_code=response.status_code,
+                    tools_rejected=bool(tools) and is_tools_rejection(response.status_code, body),
+                )
+
+            async for line in response.aiter_lines():
+                # Skip keep-alive comments (": OPENROUTER PROCESSING") and blank separators
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+
+                chunk = json.loads(data)
+                if "error" in chunk:
+                    raise _api_error(chunk["error"], tools)
+
+                delta = chunk.get("choices", [{}])[0].get("delta", {})
+                if delta.get("content"):
+                    yield delta["content"], None
+
+                for fragment in delta.get("tool_calls") or []:
+                    call = partial_tool_calls.setdefault(fragment.get("index", 0), {"function": {"name": "", "arguments": ""}})
+                    function = fragment.get("function", {})
+                    call["function"]["name"] += function.get("name") or ""
+                    call["function"]["arguments"] += function.get("arguments") or ""
+
+        if partial_tool_calls:
+            yield "", _parse_tool_calls([partial_tool_calls[index] for index in sorted(partial_tool_calls)])
+
+    except httpx.RequestError as e:
+        print(f"Request failed: {str(e)}")
+        raise ProviderError(f"Failed to get response from OpenRouter: {str(e)}", retryable=True)
+    except json.JSONDecodeError as e:
+        print(f"Invalid JSON chunk in stream: {e}")
+        raise ProviderError("Invalid streaming response from OpenRouter", retryable=True)
+
 if __name__ == "__main__":
     # Example usage
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    test_response = open_router_provider("hello", "moonshotai/kimi-k2:free", api_key, "You are a helpful assistant.")
-    print(test_response)  # Should print the response from the model
\ No newline at end of file
+    async def _example():
+        try:
+            content, _ = await open_router_provider("You are a helpful assistant.", "hello", "")
+            return content
+        finally:
+            await close_provider_clients()
+
+    test_response = asyncio.run(_example())
+    print(test_response)  # Should print the response from the model
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+
+from memory.sqlite_actions import add_cached_response, get_cached_responses, delete_cached_responses
+from utils import metrics
+
+# ---------------------------
+# Config
+# ---------------------------
+
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "false").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 86400))  # seconds; 0 = never expire
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1000))
+# Number of recent messages that are part of the key; 0 = answers do not depend on the conversation
+RESPONSE_CACHE_HISTORY_WINDOW = int(os.getenv("RESPONSE_CACHE_HISTORY_WINDOW", 0))
+# Also reuse answers to differently worded questions whose embeddings are close enough
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "false").lower() == "true"
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0.92))
+
+# key -> {"scope", "message", "response", "embedding", "created_at"}, least recently used first
+_entries = OrderedDict()
+
+# ---------------------------
+# Keys
+# ---------------------------
+
+def _hash(*parts):
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+def normalize_message(message):
+    """Lowercases, collapses whitespace and drops trailing punctuation."""
+    return re.sub(r"\s+", " ", (message or "").strip().lower()).rstrip("?!. ")
+
+def scope_key(being, rag_context, history):
+    """
+    Everything besides the message that the answer depends on: the being
+    (persona, provider, tools...), the RAG facts and the recent history window.
+    `history` is chronological (oldest first) as (message, role, created_at).
+    """
+    window = history[-RESPONSE_CACHE_HISTORY_WINDOW:] if RESPONSE_CACHE_HISTORY_WINDOW > 0 else []
+    return _hash(
+        json.dumps(being, sort_keys=True, default=str),
+        rag_context or "",
+        json.dumps([(msg, role) for msg, role, *_ in window]),
+    )
+
+def _embed(text):
+    # Reuses the RAG embedding model (and its query batcher), so no second model is loaded
+    from rag.query_embedder import embed_query
+
+    vector = [float(value) for value in embed_query(text)]
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+# ---------------------------
+# Storage
+# ---------------------------
+
+def _expired(entry, at=None):
+    return RESPONSE_CACHE_TTL > 0 and (at or time.time()) - entry["created_at"] > RESPONSE_CACHE_TTL
+
+def _remember(key, entry):
+    """Adds an entry in memory; returns the keys evicted to stay within RESPONSE_CACHE_MAX_ENTRIES."""
+    _entries[key] = entry
+    _entries.move_to_end(key)
+    evicted = []
+    while len(_entries) > RESPONSE_CACHE_MAX_ENTRIES:
+        evicted_key, _ = _entries.popitem(last=False)
+        evicted.append(evicted_key)
+    return evicted
+
+def load_response_cache():
+    """Warms the in-memory cache from sqlite, dropping rows that expired while the server was down."""
+    if not RESPONSE_CACHE:
+        return
+
+    _entries.clear()
+    stale = []
+    for key, scope, message, response, embedding, created_at in reversed(get_cached_responses(RESPONSE_CACHE_MAX_ENTRIES)):
+        entry = {
+            "scope": scope,
+            "message": message,
+            "response": response,
+            "embedding": json.loads(embedding) if embedding else None,
+            "created_at": created_at,
+        }
+        if _expired(entry):
+            stale.append(key)
+        else:
+            _remember(key, entry)
+
+    if stale:
+        delete_cached_responses(stale)
+    print(f"[CACHE] Loaded {len(_entries)} cached responses ({len(stale)} expired).")
+
+def _get(key):
+    entry = _entries.get(key)
+    if entry is None:
+        return None
+    if _expired(entry):
+        del _entries[key]
+        return None
+    _entries.move_to_end(key)
+    return entry
+
+def _semantic_match(scope, embedding):
+    best_key, best_score = None, RESPONSE_CACHE_SIMILARITY
+    at = time.time()
+    for key, entry in _entries.items():
+        if entry["scope"] != scope or not entry["embedding"] or _expired(entry, at):
+            continue
+        score = sum(a * b for a, b in zip(embedding, entry["embedding"]))
+        if score >= best_score:
+            best_key, best_score = key, score
+    return (_get(best_key), best_score) if best_key else (None, None)
+
+# ---------------------------
+# Public API
+# ---------------------------
+
+async def lookup(being, rag_context, history, message):
+    """
+    Returns (response, pending). On a hit `response` is the cached answer;
+    on a miss it is None and `pending` should be passed to store() once the
+    turn finishes, if the turn turned out to be cacheable.
+    """
+    scope = scope_key(being, rag_context, history)
+    normalized = normalize_message(message)
+    key = _hash(scope, normalized)
+
+    entry = _get(key)
+    if entry:
+        metrics.increment("response_cache.hits")
+        print("[CACHE] Exact hit.")
+        return entry["response"], None
+
+    embedding = None
+    if RESPONSE_CACHE_SEMANTIC:
+        embedding = await asyncio.to_thread(_embed, normalized)
+        entry, score = _semantic_match(scope, embedding)
+        if entry:
+            metrics.increment("response_cache.semantic_hits")
+            print(f"[CACHE] Semantic hit ({score:.3f}) for: {entry['message']}")
+            return entry["response"], None
+
+    metrics.increment("response_cache.misses")
+    return None, {"key": key, "scope": scope, "message": message, "embedding": embedding}
+
+async def store(pending, response):
+    """Caches a finished turn's answer in memory and sqlite."""
+    if not pending or not response:
+        return
+
+    entry = {
+        "scope": pending["scope"],
+        "message": pending["message"],
+        "response": response,
+        "embedding": pending["embedding"],
+        "created_at": time.time(),
+    }
+    evicted = _remember(pending["key"], entry)
+
+    embedding = json.dumps(entry["embedding"]) if entry["embedding"] else None
+    await asyncio.to_thread(
+        add_cached_response, pending["key"], entry["scope"], entry["message"], response, embedding, entry["created_at"]
+    )
+    if evicted:
+        metrics.increment("response_cache.evictions", len(evicted))
+        await asyncio.to_thread(delete_cached_responses, evicted)
@@ -0,0 +1,32 @@
+import asyncio
+import re
+import weakref
+
+from memory.sqlite_actions import DEFAULT_SESSION_ID
+
+# Session ids come from clients, so keep them short and boring
+SESSION_ID_REGEX = re.compile(r"^[A-Za-z0-9_.:@-]{1,128}$")
+
+# (context_id, session_id) -> lock. Weak values, so locks of idle sessions are
+# dropped and thousands of sessions do not accumulate locks forever.
+_locks = weakref.WeakValueDictionary()
+
+def normalize_session_id(session_id):
+    """Returns the session id to use, raising ValueError for ids clients should not send."""
+    if session_id is None or session_id == "":
+        return DEFAULT_SESSION_ID
+    if not SESSION_ID_REGEX.match(session_id):
+        raise ValueError("session_id must be 1-128 characters of letters, digits, '_', '-', '.', ':' or '@'")
+    return session_id
+
+def session_lock(context_id, session_id):
+    """
+    Lock that serializes turns within one session so their messages never
+    interleave; turns of different sessions run in parallel.
+    """
+    key = (context_id, session_id)
+    lock = _locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _locks[key] = lock
+    return lock
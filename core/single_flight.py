@@ -0,0 +1,60 @@
+import asyncio
+import os
+from collections import defaultdict
+
+from memory.sqlite_actions import DEFAULT_SESSION_ID
+from utils import metrics
+
+# ---------------------------
+# Config
+# ---------------------------
+
+# Identical requests that arrive while the first one is still running share its result
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
+
+# key -> task computing the shared result
+_inflight = {}
+
+# (context_id, session_id) -> version, bumped whenever a turn in that session
+# finishes, so requests only coalesce when they would see the same history
+_context_versions = defaultdict(int)
+
+# ---------------------------
+# Context snapshot
+# ---------------------------
+
+def context_version(context_id, session_id=DEFAULT_SESSION_ID):
+    return _context_versions.get((context_id, session_id), 0)
+
+def bump_context_version(context_id, session_id=DEFAULT_SESSION_ID):
+    _context_versions[(context_id, session_id)] += 1
+
+def request_key(being, message, session_id=DEFAULT_SESSION_ID):
+    """Coalescing key: being, session, exact message and the context snapshot."""
+    context_id = being["contextId"]
+    return (context_id, being.get("name"), session_id, message, context_version(context_id, session_id))
+
+# ---------------------------
+# Public API
+# ---------------------------
+
+async def run(key, factory):
+    """
+    Runs `factory()` once per key among concurrent callers; every caller gets
+    the same result (or exception). The work runs in its own task, so a
+    caller going away does not cancel it for the others.
+    """
+    if not SINGLE_FLIGHT:
+        return await factory()
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        _inflight[key] = task
+        task.add_done_callback(lambda done: _inflight.pop(key) if _inflight.get(key) is done else None)
+        metrics.increment("single_flight.calls")
+    else:
+        metrics.increment("single_flight.saved_calls")
+        print(f"[SINGLE_FLIGHT] Joined an in-flight request ({len(_inflight)} in flight).")
+
+    return await asyncio.shield(task)
@@ -1,23 +1,46 @@
 # main.py
+import time
+_IMPORTS_STARTED = time.perf_counter()
+
 import argparse
+import json
 import os
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
+# Before the app imports: their settings are read from the environment at import time
+load_dotenv()
+
 import uvicorn
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import Optional
 
-from core.agent import get_ai_response
+from core.agent import get_ai_response, stream_ai_response
+from core.providers.clients import close_provider_clients
+from core.response_cache import load_response_cache
+from core import single_flight
+from core.sessions import normalize_session_id
 from parsers.parse_being_json import load_being_json
 from tasks.live import agent_live
+from tasks.memory_maintenance import memory_maintenance, memory_retention, MEMORY_MAINTENANCE
 from utils.print_details import print_being_details
-from rag.rag_system import ingest_data, search_rag
+from rag.rag_system import search_rag, warm_up
+from tasks import rag_ingestion
 from memory.sqlite_setup import setup_database
+from memory.connection import init_connections, close_connections
+from memory.message_log import start_writer, stop_writer
+from memory.sqlite_actions import get_messages_page
+from memory.history_export import export_ndjson, message_to_dict
+from memory.retention import retention_enabled
+from utils import metrics, startup_timing
 
-load_dotenv()
+# The embedding model and Chroma load lazily, so this covers the app's own modules
+startup_timing.record("imports", time.perf_counter() - _IMPORTS_STARTED)
 
 # --- CLI Argument Parsing (must be before app creation) ---
 parser = argparse.ArgumentParser(description="Run the FastAPI application with optional being name.")
@@ -57,6 +80,16 @@ TWEET_INTERVAL = int(os.getenv("TWEET_INTERVAL", 2))
 
 AGENT_ALIVE = os.getenv("AGENT_ALIVE", "false").lower() == "true"
 
+# Load the RAG model in the background so the port opens immediately;
+# searches made before it finishes wait for the model. Ingestion always runs in the background.
+RAG_WARMUP_BACKGROUND = os.getenv("RAG_WARMUP_BACKGROUND", "false").lower() == "true"
+
+# Largest page GET /history returns
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", 1000))
+
+# Threads used for blocking work (sqlite, RAG search, sync tools) offloaded from the event loop
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", 64))
+
 # --- Application State and Lifespan Management ---
 
 @asynccontextmanager
@@ -67,25 +100,56 @@ async def lifespan(app: FastAPI):
     # -- Startup --
     print("INFO:     Starting up application...")
 
+    # Size the default executor used by asyncio.to_thread for concurrent conversations
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="jitter-worker")
+    )
+
+    startup_started = time.perf_counter()
+
     # Ensure DB tables exist before any RAG/model logic
-    setup_database()
+    with startup_timing.timed("database"):
+        setup_database()
+        # Shared per-thread connections in WAL mode for conversation memory
+        init_connections()
+        # Background group-commit writer for messages (no-op unless MEMORY_WRITE_BEHIND=true)
+        start_writer()
 
-    # Load resources once
-    being_data = load_being_json(being_name=_being_name_from_cli)
-    print_being_details(being_data)
+    # Warm the response cache from sqlite (no-op unless RESPONSE_CACHE=true)
+    with startup_timing.timed("response_cache"):
+        load_response_cache()
 
-    # Ingest RAG data (process new/changed files and update index/db)
-    ingest_data()
+    # Load resources once
+    with startup_timing.timed("being"):
+        being_data = load_being_json(being_name=_being_name_from_cli)
+        print_being_details(being_data)
 
     # Store being in the app state for access elsewhere
     app.state.being = being_data
-    
+
     # Create and start background tasks
     tasks = []
-    
+
+    # Load the embedding model, then ingest RAG data in the background (new/changed/deleted files)
+    if not RAG_WARMUP_BACKGROUND:
+        warm_up()
+    rag_ingestion.enqueue()
+    tasks.append(asyncio.create_task(rag_ingestion.rag_ingestion()))
+    if rag_ingestion.RAG_WATCH:
+        tasks.append(asyncio.create_task(rag_ingestion.watch_rag_files()))
+
     if AGENT_ALIVE:
         tasks.append(asyncio.create_task(agent_live(app)))
 
+    if MEMORY_MAINTENANCE:
+        tasks.append(asyncio.create_task(memory_maintenance(app)))
+
+    if retention_enabled():
+        tasks.append(asyncio.create_task(memory_retention(app)))
+
+    startup_timing.record("startup", time.perf_counter() - startup_started)
+    print(f"[STARTUP] {startup_timing.format_report()}")
+
     yield
 
     # -- Shutdown --
@@ -97,6 +161,12 @@ async def lifespan(app: FastAPI):
     except asyncio.CancelledError:
         print("INFO:     All background tasks cancelled successfully.")
 
+    # Close pooled provider connections
+    await close_provider_clients()
+    # Write out queued messages before the connections go away
+    stop_writer()
+    close_connections()
+
 # Create the FastAPI app with the lifespan manager
 server_app = FastAPI(lifespan=lifespan)
 
@@ -112,6 +182,8 @@ def get_being():
 
 class Message(BaseModel):
     content: str
+    # Conversation the message belongs to; each session has its own memory
+    session_id: Optional[str] = None
 
 server_app.add_middleware(
     CORSMiddleware,
@@ -127,6 +199,66 @@ async def get_being_details(being: dict = Depends(get_being)):
     return being
 
 
+@server_app.get("/metrics")
+async def get_metrics():
+    """Returns in-process counters and observations (e.g. tokens sent per model call)."""
+    return metrics.snapshot()
+
+
+@server_app.get("/rag/status")
+async def get_rag_status():
+    """Returns whether the RAG index is ready and the state of background ingestion."""
+    return rag_ingestion.status()
+
+
+@server_app.get("/history")
+async def get_history(
+    session_id: Optional[str] = None,
+    after_id: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1),
+    being: dict = Depends(get_being)
+):
+    """
+    Returns a session's stored messages oldest first, one page at a time.
+    Pass the returned `next_after_id` as `after_id` to get the next page;
+    it is null once the last page was returned.
+    """
+    try:
+        session_id = normalize_session_id(session_id)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    limit = min(limit, HISTORY_PAGE_MAX)
+    rows = await asyncio.to_thread(get_messages_page, being["contextId"], session_id, after_id, limit)
+    return {
+        "session_id": session_id,
+        "messages": [message_to_dict(row) for row in rows],
+        "next_after_id": rows[-1][0] if len(rows) == limit else None,
+    }
+
+
+@server_app.get("/history/export")
+async def export_history(
+    session_id: Optional[str] = None,
+    after_id: int = Query(0, ge=0),
+    being: dict = Depends(get_being)
+):
+    """
+    Streams the being's stored messages as NDJSON, oldest first, in constant memory.
+    Exports every session unless `session_id` is given.
+    """
+    try:
+        session_id = normalize_session_id(session_id) if session_id else None
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    return StreamingResponse(
+        export_ndjson(being["contextId"], session_id, after_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{being["contextId"]}-history.ndjson"'},
+    )
+
+
 @server_app.post("/message")
 async def get_message_response(
     message: Message,
@@ -137,16 +269,59 @@ async def get_message_response(
         raise HTTPException(status_code=400, detail="Message cannot be empty")
 
     try:
-        rag_context = search_rag(message.content, top_k=3)
-        response = get_ai_response(being, rag_context, message.content)
+        session_id = normalize_session_id(message.session_id)
+
+        async def respond():
+            # Embedding + vector search is CPU/disk bound, so keep it off the event loop
+            rag_context = await asyncio.to_thread(search_rag, message.content, top_k=3)
+            return await get_ai_response(being, rag_context, message.content, session_id=session_id)
+
+        # Identical concurrent requests share one RAG search and model turn
+        response = await single_flight.run(single_flight.request_key(being, message.content, session_id), respond)
         if not response:
             raise ValueError("AI response was empty")
-        return {"response": response}
+        return {"response": response, "session_id": session_id}
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
 
+def format_sse(event: dict) -> str:
+    """Formats an agent event as a server-sent event frame."""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+@server_app.post("/message/stream")
+async def stream_message_response(
+    message: Message,
+    being: dict = Depends(get_being)
+):
+    """
+    Streams an AI response as server-sent events.
+    Emits `context` (prompt token breakdown), `token`, `tool_call` and
+    `tool_result` events while the turn runs,
+    then a final `done` event (or an `error` event if the turn fails).
+    """
+    if not message.content:
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    try:
+        session_id = normalize_session_id(message.session_id)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    async def event_stream():
+        try:
+            rag_context = await asyncio.to_thread(search_rag, message.content, top_k=3)
+            async for event in stream_ai_response(being, rag_context, message.content, session_id=session_id):
+                yield format_sse(event)
+        except Exception as e:
+            yield format_sse({"type": "error", "detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # --- Main entry point ---
 if __name__ == "__main__":
     uvicorn.run(
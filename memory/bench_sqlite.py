@@ -0,0 +1,93 @@
+"""
+Benchmarks conversation memory writes and reads.
+
+    python -m memory.bench_sqlite --messages 2000 --threads 8
+
+Compares the old connect-per-call access (default rollback journal) with the
+shared thread-local connections in WAL mode used by memory.sqlite_actions.
+Runs against throwaway databases in a temporary directory.
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from memory.connection import init_connections, close_connections
+from memory.sqlite_actions import add_message, get_num_messages_by_id
+from memory.sqlite_setup import setup_database
+
+def legacy_add_message(db_path, context_id, message, role, session_id):
+    """Connect, insert, commit and close, as every call used to."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(
+            "INSERT INTO messages (context_id, session_id, message, role) VALUES (?, ?, ?, ?)",
+            (context_id, session_id, message, role),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def legacy_get_messages(db_path, context_id, num_messages, session_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT message, role, created_at FROM messages WHERE context_id = ? AND session_id = ? "
+            "ORDER BY created_at DESC, id DESC LIMIT ?",
+            (context_id, session_id, num_messages),
+        ).fetchall()
+    finally:
+        conn.close()
+
+def _run(label, work, count, threads):
+    started = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(work, range(count)))
+    else:
+        for i in range(count):
+            work(i)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {count / elapsed:>10.0f} ops/sec  ({elapsed:.2f}s)")
+    return count / elapsed
+
+def bench(messages, threads, sessions):
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_db = os.path.join(tmp, "legacy.db")
+        pooled_db = os.path.join(tmp, "pooled.db")
+        setup_database(legacy_db)
+        setup_database(pooled_db)
+
+        def legacy_insert(i):
+            legacy_add_message(legacy_db, "bench", f"message {i}", "user", f"s{i % sessions}")
+
+        def legacy_read(i):
+            legacy_get_messages(legacy_db, "bench", 20, f"s{i % sessions}")
+
+        def pooled_insert(i):
+            add_message("bench", f"message {i}", "user", f"s{i % sessions}")
+
+        def pooled_read(i):
+            get_num_messages_by_id("bench", 20, f"s{i % sessions}")
+
+        print(f"\n{messages} messages, {threads} thread(s), {sessions} session(s)\n")
+        before_insert = _run("inserts: connect per call", legacy_insert, messages, threads)
+        before_read = _run("reads:   connect per call", legacy_read, messages, threads)
+
+        init_connections(pooled_db)
+        after_insert = _run("inserts: shared WAL connections", pooled_insert, messages, threads)
+        after_read = _run("reads:   shared WAL connections", pooled_read, messages, threads)
+        close_connections()
+
+        print(f"\ninsert speedup: {after_insert / before_insert:.1f}x, read speedup: {after_read / before_read:.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark conversation memory inserts and reads.")
+    parser.add_argument("--messages", type=int, default=2000, help="Messages to insert (and history reads to run).")
+    parser.add_argument("--threads", type=int, default=1, help="Concurrent worker threads.")
+    parser.add_argument("--sessions", type=int, default=50, help="Sessions the messages are spread over.")
+    args = parser.parse_args()
+
+    bench(args.messages, args.threads, args.sessions)
@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ---------------------------
+# Config
+# ---------------------------
+
+DB_PATH = os.path.join(os.path.dirname(__file__), "agent_memory.db")
+
+# NORMAL is durable across application crashes in WAL mode; a power loss can drop the last commits
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 16384))  # page cache per connection
+SQLITE_MMAP_SIZE_MB = int(os.getenv("SQLITE_MMAP_SIZE_MB", 64))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", 256))  # prepared statements kept per connection
+
+# One connection per thread (the event loop and asyncio.to_thread workers),
+# reused across calls so statements stay prepared and no connect happens per query
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+# Bumped by close_connections so threads reconnect instead of using a closed connection
+_generation = 0
+_db_path = DB_PATH
+
+# ---------------------------
+# Connections
+# ---------------------------
+
+def _connect(db_path):
+    conn = sqlite3.connect(
+        db_path,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=SQLITE_STATEMENT_CACHE,
+        # Only the owning thread uses it; close_connections closes it from the shutdown thread
+        check_same_thread=False,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE_MB * 1024 * 1024}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def get_connection():
+    """Returns this thread's connection to the memory database, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.generation != _generation:
+        conn = _connect(_db_path)
+        _local.conn = conn
+        _local.generation = _generation
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+def init_connections(db_path=None):
+    """
+    Points the manager at the database (default memory/agent_memory.db) and
+    switches it to WAL mode. Call after setup_database().
+    """
+    global _db_path
+    close_connections()
+    _db_path = db_path or DB_PATH
+    mode = get_connection().execute("PRAGMA journal_mode").fetchone()[0]
+    print(f"[SQLITE] Connected to {os.path.basename(_db_path)} (journal_mode={mode}, synchronous={SQLITE_SYNCHRONOUS}).")
+
+def close_connections():
+    """Closes every thread's connection; threads transparently reconnect on next use."""
+    global _generation
+    with _connections_lock:
+        _generation += 1
+        connections = list(_connections)
+        _connections.clear()
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"[SQLITE] Error closing connection: {e}")
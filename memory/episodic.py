@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import os
+
+from dotenv import load_dotenv
+
+from memory.sqlite_actions import get_messages_to_summarize, get_episodic_progress, save_episodic_progress, DEFAULT_SESSION_ID
+from tools.handle_tool_call import is_tool_call
+from utils import metrics
+from utils.enums import Numbers, Role
+
+load_dotenv()
+
+# ---------------------------
+# Config
+# ---------------------------
+
+# Embed past turns and retrieve the most relevant ones for each new message
+EPISODIC_MEMORY = os.getenv("EPISODIC_MEMORY", "false").lower() == "true"
+EPISODIC_TOP_K = int(os.getenv("EPISODIC_TOP_K", 3))
+# Cosine distance above which a past turn is considered unrelated
+EPISODIC_MAX_DISTANCE = float(os.getenv("EPISODIC_MAX_DISTANCE", 0.6))
+EPISODIC_BATCH = int(os.getenv("EPISODIC_BATCH", 256))  # messages embedded per session per pass
+EPISODE_SIDE_CHARS = 300
+
+# Only turns that left the history window are embedded, so retrieval never repeats recent history
+KEEP_RECENT = Numbers.MAX_MESSAGES.value
+
+_collections = {}
+
+# ---------------------------
+# Helpers
+# ---------------------------
+
+def _collection(context_id):
+    """Per-context Chroma collection, sharing the RAG client and MiniLM embedding model."""
+    collection = _collections.get(context_id)
+    if collection is None:
+        from rag.rag_system import get_client, get_embedding_fn
+
+        name = f"episodes_{hashlib.sha256(context_id.encode('utf-8')).hexdigest()[:32]}"
+        collection = get_client().get_or_create_collection(
+            name=name,
+            embedding_function=get_embedding_fn(),
+            metadata={"hnsw:space": "cosine", "context_id": context_id},
+        )
+        _collections[context_id] = collection
+    return collection
+
+def _clip(text):
+    text = " ".join((text or "").split())
+    return text if len(text) <= EPISODE_SIDE_CHARS else text[:EPISODE_SIDE_CHARS - 3].rstrip() + "..."
+
+def pair_turns(rows):
+    """
+    Pairs each user message with the assistant's final reply (tool calls and
+    tool results are skipped). Returns (episodes, last_complete_id), where
+    episodes are (assistant_message_id, user_text, reply_text).
+    """
+    episodes = []
+    pending_user = None
+    last_complete_id = 0
+    for message_id, message, role in rows:
+        if role == Role.USER.value:
+            pending_user = (message_id, message)
+        elif role == Role.ASSISTANT.value and pending_user and not is_tool_call(message or ""):
+            episodes.append((message_id, pending_user[1], message))
+            pending_user = None
+        if pending_user is None:
+            last_complete_id = message_id
+    # A user message still waiting for its reply is read again next pass
+    if pending_user is not None:
+        last_complete_id = pending_user[0] - 1
+    return episodes, last_complete_id
+
+# ---------------------------
+# Public API
+# ---------------------------
+
+def index_session(context_id, session_id, name="Assistant"):
+    """Embeds a session's turns that left the history window since the last pass. Returns episodes added."""
+    if not EPISODIC_MEMORY:
+        return 0
+
+    after_id = get_episodic_progress(context_id, session_id)
+    rows = get_messages_to_summarize(context_id, session_id, after_id, KEEP_RECENT, EPISODIC_BATCH)
+    if not rows:
+        return 0
+
+    episodes, last_complete_id = pair_turns(rows)
+    if episodes:
+        _collection(context_id).upsert(
+            ids=[f"{session_id}:{message_id}" for message_id, _, _ in episodes],
+            documents=[f"User: {_clip(user)} | {name}: {_clip(reply)}" for _, user, reply in episodes],
+            metadatas=[{"session_id": session_id, "message_id": message_id} for message_id, _, _ in episodes],
+        )
+        metrics.increment("episodic.episodes_indexed", len(episodes))
+    if last_complete_id > after_id:
+        save_episodic_progress(context_id, session_id, last_complete_id)
+    return len(episodes)
+
+def search_episodes(context_id, query, session_id=DEFAULT_SESSION_ID, top_k=EPISODIC_TOP_K):
+    """Most relevant past turns of the session, one line each, most relevant first."""
+    if not EPISODIC_MEMORY or not query:
+        return ""
+
+    collection = _collection(context_id)
+    if collection.count() == 0:
+        return ""
+
+    from rag.query_embedder import embed_query
+
+    results = collection.query(query_embeddings=[embed_query(query)], n_results=top_k, where={"session_id": session_id})
+    documents = results.get("documents", [[]])[0]
+    distances = results.get("distances", [[]])[0] or [0.0] * len(documents)
+    relevant = [doc for doc, distance in zip(documents, distances) if distance <= EPISODIC_MAX_DISTANCE]
+    metrics.increment("episodic.hits" if relevant else "episodic.misses")
+    return "\n".join(relevant)
+
+async def recall(context_id, query, session_id=DEFAULT_SESSION_ID):
+    """search_episodes off the event loop; retrieval errors only cost the turn its episodes."""
+    if not EPISODIC_MEMORY:
+        return ""
+    try:
+        return await asyncio.to_thread(search_episodes, context_id, query, session_id)
+    except Exception as e:
+        print(f"[EPISODIC] Retrieval failed for {context_id}/{session_id}: {e}")
+        return ""
@@ -0,0 +1,80 @@
+import os
+from collections import OrderedDict, deque
+from itertools import islice
+
+from dotenv import load_dotenv
+
+from utils import metrics
+
+load_dotenv()
+
+# ---------------------------
+# Config
+# ---------------------------
+
+HISTORY_CACHE = os.getenv("HISTORY_CACHE", "true").lower() == "true"
+# Most recent messages kept per (context, session); reads asking for more go to sqlite
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", 50))
+# Sessions kept in memory; the least recently used one is evicted beyond this
+HISTORY_CACHE_MAX_SESSIONS = int(os.getenv("HISTORY_CACHE_MAX_SESSIONS", 10000))
+
+# (context_id, session_id) -> deque of (message, role, created_at), oldest first.
+# Only touched from the event loop, so no locking is needed.
+_buffers = OrderedDict()
+# Keys being loaded from sqlite, mapped to whether a write arrived meanwhile
+_loading = {}
+
+# ---------------------------
+# Public API
+# ---------------------------
+
+def get(key, num_messages):
+    """Returns the last n messages newest first, or None if they are not all in memory."""
+    if not HISTORY_CACHE or num_messages > HISTORY_CACHE_SIZE:
+        return None
+    buffer = _buffers.get(key)
+    if buffer is None:
+        metrics.increment("history_cache.misses")
+        return None
+    _buffers.move_to_end(key)
+    metrics.increment("history_cache.hits")
+    return list(islice(reversed(buffer), num_messages))
+
+def begin_load(key):
+    """Marks a cold read from sqlite; writes during the read make its result unsafe to cache."""
+    if HISTORY_CACHE:
+        _loading[key] = False
+
+def finish_load(key, rows):
+    """
+    Caches rows (newest first, as sqlite returns them) unless a write raced
+    the read. Pass None when the read failed.
+    """
+    if not HISTORY_CACHE:
+        return
+    dirty = _loading.pop(key, True)
+    if dirty or rows is None:
+        return
+    _buffers[key] = deque(reversed(rows[:HISTORY_CACHE_SIZE]), maxlen=HISTORY_CACHE_SIZE)
+    _buffers.move_to_end(key)
+    while len(_buffers) > HISTORY_CACHE_MAX_SESSIONS:
+        _buffers.popitem(last=False)
+        metrics.increment("history_cache.evictions")
+
+def append(key, row):
+    """Write-through for a new (message, role, created_at) row. Uncached sessions load on their next read."""
+    if not HISTORY_CACHE:
+        return
+    if key in _loading:
+        _loading[key] = True
+    buffer = _buffers.get(key)
+    if buffer is not None:
+        buffer.append(row)
+
+def invalidate(context_id, session_id=None):
+    """Drops a session (or every session of a context) after messages were deleted."""
+    for key in [key for key in _buffers if key[0] == context_id and (session_id is None or key[1] == session_id)]:
+        del _buffers[key]
+
+def clear():
+    _buffers.clear()
@@ -0,0 +1,55 @@
+"""
+Streams conversation history as NDJSON (one JSON object per message) in
+constant memory, for bulk dumps and analytics pulls.
+
+    python -m memory.history_export --context_id jitter --out history.ndjson
+
+Without --context_id every message in the database is exported.
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from memory.connection import close_connections
+from memory.sqlite_actions import MESSAGE_COLUMNS, MESSAGE_PAGE_SIZE, get_messages_page, iter_messages
+
+def message_to_dict(row):
+    return dict(zip(MESSAGE_COLUMNS, row))
+
+def to_ndjson(row):
+    return json.dumps(message_to_dict(row), ensure_ascii=False) + "\n"
+
+async def export_ndjson(context_id=None, session_id=None, after_id=0, page_size=MESSAGE_PAGE_SIZE):
+    """Async generator of NDJSON lines, reading one keyset page at a time off the event loop."""
+    while True:
+        page = await asyncio.to_thread(get_messages_page, context_id, session_id, after_id, page_size)
+        if page:
+            yield "".join(to_ndjson(row) for row in page)
+        if len(page) < page_size:
+            return
+        after_id = page[-1][0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Export conversation history as NDJSON.")
+    parser.add_argument("--context_id", type=str, default=None, help="Only export this context (default: all messages)")
+    parser.add_argument("--session_id", type=str, default=None, help="Only export this session")
+    parser.add_argument("--after_id", type=int, default=0, help="Only export messages with a greater id (resume a dump)")
+    parser.add_argument("--out", type=str, default=None, help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    # Connections open lazily; init_connections() would print to stdout
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    count = 0
+    try:
+        for row in iter_messages(args.context_id, args.session_id, args.after_id):
+            out.write(to_ndjson(row))
+            count += 1
+    finally:
+        if args.out:
+            out.close()
+        close_connections()
+    print(f"Exported {count} messages.", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from memory import history_cache, summaries
+from memory.sqlite_actions import add_message, add_messages, get_num_messages_by_id, DEFAULT_SESSION_ID
+from utils import metrics
+
+load_dotenv()
+
+# ---------------------------
+# Config
+# ---------------------------
+
+# Queue messages for a background writer instead of committing each one inline
+MEMORY_WRITE_BEHIND = os.getenv("MEMORY_WRITE_BEHIND", "false").lower() == "true"
+MEMORY_FLUSH_INTERVAL_MS = float(os.getenv("MEMORY_FLUSH_INTERVAL_MS", 50))
+MEMORY_FLUSH_MAX_ROWS = int(os.getenv("MEMORY_FLUSH_MAX_ROWS", 256))
+# Producers wait (off the event loop) once this many messages are waiting to be written
+MEMORY_QUEUE_SIZE = int(os.getenv("MEMORY_QUEUE_SIZE", 10000))
+
+_STOP = object()
+
+_queue = queue.Queue(maxsize=MEMORY_QUEUE_SIZE)
+_writer = None
+
+# (context_id, session_id) -> rows queued but not yet committed, oldest first.
+# Readers merge them into history so a session always sees its own writes.
+_pending = defaultdict(deque)
+_pending_lock = threading.Lock()
+# Held while a batch commits and its rows leave _pending, and while readers
+# combine the database with _pending, so no row is seen twice or missed
+_flush_lock = threading.Lock()
+# When the last message was logged; background work such as vacuuming waits for quiet periods
+_last_activity = time.monotonic()
+
+# ---------------------------
+# Writer
+# ---------------------------
+
+def _timestamp():
+    # Same format as SQLite's CURRENT_TIMESTAMP, taken when the message is queued
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+def _flush(batch):
+    # Queue items are already (context_id, session_id, message, role, created_at, token_count) rows
+    with _flush_lock:
+        try:
+            add_messages(batch)
+        except Exception as e:
+            # Write what can be written; a bad row must not take the rest of the batch with it
+            print(f"[MEMORY] Batch write of {len(batch)} messages failed ({e}). Retrying one by one.")
+            for row in batch:
+                try:
+                    add_messages([row])
+                except Exception as row_error:
+                    metrics.increment("memory.dropped_messages")
+                    print(f"[MEMORY] Dropped message for context {row[0]}: {row_error}")
+
+        with _pending_lock:
+            for context_id, session_id, *_ in batch:
+                key = (context_id, session_id)
+                _pending[key].popleft()
+                if not _pending[key]:
+                    del _pending[key]
+
+    metrics.increment("memory.flushes")
+    metrics.observe("memory.flush_rows", len(batch))
+
+def _writer_loop():
+    interval = MEMORY_FLUSH_INTERVAL_MS / 1000
+    stopping = False
+    while not stopping:
+        item = _queue.get()
+        if item is _STOP:
+            break
+
+        # Group commit: gather rows for up to one interval or MEMORY_FLUSH_MAX_ROWS rows
+        batch = [item]
+        deadline = time.monotonic() + interval
+        while len(batch) < MEMORY_FLUSH_MAX_ROWS:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = _queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+
+        _flush(batch)
+
+def start_writer():
+    """Starts the background writer when MEMORY_WRITE_BEHIND is enabled."""
+    global _writer
+    if not MEMORY_WRITE_BEHIND or _writer is not None:
+        return
+    _writer = threading.Thread(target=_writer_loop, name="jitter-memory-writer", daemon=True)
+    _writer.start()
+    print(f"[MEMORY] Write-behind enabled (every {MEMORY_FLUSH_INTERVAL_MS:g}ms or {MEMORY_FLUSH_MAX_ROWS} rows).")
+
+def stop_writer():
+    """Flushes everything still queued and stops the writer. Call on shutdown."""
+    global _writer
+    if _writer is None:
+        return
+    writer, _writer = _writer, None
+    _queue.put(_STOP)
+    writer.join()
+
+    # Messages queued after the stop marker
+    leftover = []
+    while True:
+        try:
+            item = _queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is not _STOP:
+            leftover.append(item)
+    if leftover:
+        _flush(leftover)
+    print("[MEMORY] Write-behind queue flushed.")
+
+# ---------------------------
+# Public API
+# ---------------------------
+
+async def log_message(context_id, message, role, session_id=DEFAULT_SESSION_ID, token_count=None):
+    """Stores a message: queued for the background writer in write-behind mode, otherwise written now."""
+    global _last_activity
+    _last_activity = time.monotonic()
+    created_at = _timestamp()
+    history_cache.append((context_id, session_id), (message, role, created_at))
+    summaries.mark_active((context_id, session_id))
+
+    if _writer is None:
+        await asyncio.to_thread(add_message, context_id, message, role, session_id, token_count)
+        return
+
+    item = (context_id, session_id, message, role, created_at, token_count)
+    with _pending_lock:
+        _pending[(context_id, session_id)].append(item)
+    try:
+        _queue.put_nowait(item)
+    except queue.Full:
+        # Backpressure: wait for the writer without blocking the event loop
+        metrics.increment("memory.queue_full")
+        await asyncio.to_thread(_queue.put, item)
+
+def idle_seconds():
+    """Seconds since a message was last logged."""
+    return time.monotonic() - _last_activity
+
+def _recent_messages(context_id, num_messages, session_id):
+    with _flush_lock:
+        rows = get_num_messages_by_id(context_id, num_messages, session_id)
+        with _pending_lock:
+            pending = list(_pending.get((context_id, session_id), ()))
+    if not pending:
+        return rows
+    # Queued rows are newer than anything committed; keep the newest-first order of the database
+    queued = [(message, role, created_at) for _, _, message, role, created_at, _ in reversed(pending)]
+    return (queued + list(rows))[:num_messages]
+
+async def recent_messages(context_id, num_messages, session_id=DEFAULT_SESSION_ID):
+    """
+    Last n messages of a session, newest first, including writes that are still queued.
+    Served from the in-memory history cache when possible; cold reads fill it.
+    """
+    key = (context_id, session_id)
+    cached = history_cache.get(key, num_messages)
+    if cached is not None:
+        return cached
+
+    # Read a full cache window so the next turns of this session are memory hits
+    limit = max(num_messages, history_cache.HISTORY_CACHE_SIZE) if history_cache.HISTORY_CACHE else num_messages
+    history_cache.begin_load(key)
+    rows = None
+    try:
+        rows = await asyncio.to_thread(_recent_messages, context_id, limit, session_id)
+    finally:
+        history_cache.finish_load(key, rows)
+    return rows[:num_messages]
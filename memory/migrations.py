@@ -0,0 +1,159 @@
+import sqlite3
+
+# ---------------------------
+# Helpers
+# ---------------------------
+
+def _columns(cursor, table):
+    return [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+
+def _add_column(cursor, table, column, definition):
+    if column not in _columns(cursor, table):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+# ---------------------------
+# Migrations
+# ---------------------------
+# Each migration must be safe to run against a database that already has
+# some of its changes (deployments that predate schema_version).
+
+def _baseline(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            context_id TEXT NOT NULL,
+            message TEXT NULL,
+            role TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _messages_session_id(cursor):
+    # Existing messages join the default session
+    _add_column(cursor, "messages", "session_id", "TEXT NOT NULL DEFAULT 'default'")
+
+def _messages_history_index(cursor):
+    # History reads filter on context and session and take the newest ids
+    cursor.execute("DROP INDEX IF EXISTS idx_messages_session")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_history
+        ON messages (context_id, session_id, id)
+    ''')
+
+def _response_cache(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS response_cache (
+            cache_key TEXT PRIMARY KEY,
+            scope TEXT NOT NULL,
+            message TEXT NOT NULL,
+            response TEXT NOT NULL,
+            embedding TEXT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    # Startup warms the cache with the newest entries
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_created ON response_cache (created_at)")
+
+def _drop_unused_rag_tables(cursor):
+    # RAG chunks live in Chroma and the file manifest in rag_files (migration 9); these were never written
+    cursor.execute("DROP TABLE IF EXISTS vector_chunks")
+    cursor.execute("DROP TABLE IF EXISTS processed_files")
+
+def _messages_token_count(cursor):
+    # Tokens of the message as counted by the context builder; NULL for older rows
+    _add_column(cursor, "messages", "token_count", "INTEGER NULL")
+
+def _conversation_summaries(cursor):
+    # Running summary of everything up to last_message_id, maintained in the background
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            context_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            token_count INTEGER NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (context_id, session_id)
+        )
+    ''')
+
+def _episodic_progress(cursor):
+    # Last message id of each session already embedded into episodic memory
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS episodic_progress (
+            context_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            PRIMARY KEY (context_id, session_id)
+        )
+    ''')
+
+def _rag_files(cursor):
+    # Manifest of ingested RAG files; unchanged size and mtime skip hashing, the hash skips re-parsing
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rag_files (
+            file_path TEXT PRIMARY KEY,
+            size INTEGER NULL,
+            mtime_ns INTEGER NULL,
+            sha256 TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _rag_chunks(cursor):
+    # Chunk ids stored in Chroma for each RAG file, so re-ingestion only adds new and deletes stale chunks
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rag_chunks (
+            file_path TEXT NOT NULL,
+            chunk_id TEXT NOT NULL,
+            PRIMARY KEY (file_path, chunk_id)
+        ) WITHOUT ROWID
+    ''')
+
+# Ordered (version, name, migration). Append only; never renumber or edit a released migration.
+MIGRATIONS = [
+    (1, "baseline", _baseline),
+    (2, "messages_session_id", _messages_session_id),
+    (3, "messages_history_index", _messages_history_index),
+    (4, "response_cache", _response_cache),
+    (5, "drop_unused_rag_tables", _drop_unused_rag_tables),
+    (6, "messages_token_count", _messages_token_count),
+    (7, "conversation_summaries", _conversation_summaries),
+    (8, "episodic_progress", _episodic_progress),
+    (9, "rag_files", _rag_files),
+    (10, "rag_chunks", _rag_chunks),
+]
+
+# ---------------------------
+# Runner
+# ---------------------------
+
+def get_schema_version(conn) -> int:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+def run_migrations(conn):
+    """Applies pending migrations in order, each in its own transaction. Returns the schema version."""
+    current = get_schema_version(conn)
+    for version, name, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            conn.execute("BEGIN")
+            cursor = conn.cursor()
+            migration(cursor)
+            cursor.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+            conn.commit()
+            print(f"[MIGRATIONS] Applied {version}: {name}")
+            current = version
+        except sqlite3.Error as e:
+            conn.rollback()
+            raise Exception(f"An SQLite error occurred in migration {version} ({name}): {e}")
+    return current
@@ -0,0 +1,181 @@
+"""
+Message retention: messages outside a context's policy are archived to
+zstd-compressed NDJSON segments and deleted, and the freed pages are returned
+to the file system with incremental vacuum while the agent is idle.
+
+    python -m memory.retention                               # one retention pass, then vacuum
+    python -m memory.retention --enable-incremental-vacuum   # one-off conversion of an older database
+
+The background pass runs in tasks/memory_maintenance.py.
+"""
+import argparse
+import os
+import re
+
+import zstandard
+
+from memory.history_export import to_ndjson
+from memory.sqlite_actions import (
+    get_all_sessions, get_messages_page, get_retention_cutoff, delete_messages_range,
+    get_summary, get_episodic_progress, get_free_pages, incremental_vacuum,
+)
+
+# ---------------------------
+# Config
+# ---------------------------
+
+# Default policy for every session; 0 disables a rule
+RETENTION_KEEP_MESSAGES = int(os.getenv("RETENTION_KEEP_MESSAGES", 0))  # newest messages kept per session
+RETENTION_KEEP_DAYS = int(os.getenv("RETENTION_KEEP_DAYS", 0))  # messages younger than this are kept
+# Per-context policies as messages:days, e.g. "jitter=500:30,support-bot=0:7"
+RETENTION_POLICIES = {
+    context_id.strip(): tuple(int(limit or 0) for limit in policy.split(":", 1))
+    for context_id, _, policy in (item.rpartition("=") for item in os.getenv("RETENTION_POLICIES", "").split(","))
+    if context_id.strip() and re.fullmatch(r"\d*:\d*", policy.strip())
+}
+# Archive expired messages before deleting them; false deletes them outright
+RETENTION_ARCHIVE = os.getenv("RETENTION_ARCHIVE", "true").lower() == "true"
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "archive"))
+RETENTION_SEGMENT_ROWS = int(os.getenv("RETENTION_SEGMENT_ROWS", 5000))  # messages per archive segment
+RETENTION_ZSTD_LEVEL = int(os.getenv("RETENTION_ZSTD_LEVEL", 10))
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", 3600))  # seconds between retention passes
+VACUUM_IDLE_SECONDS = float(os.getenv("VACUUM_IDLE_SECONDS", 30))  # quiet time before vacuuming
+VACUUM_PAGES = int(os.getenv("VACUUM_PAGES", 1000))  # pages freed per vacuum step
+
+# ---------------------------
+# Policies
+# ---------------------------
+
+def policy_for(context_id):
+    """(keep_messages, keep_days) for a context."""
+    return RETENTION_POLICIES.get(context_id, (RETENTION_KEEP_MESSAGES, RETENTION_KEEP_DAYS))
+
+def retention_enabled():
+    return any(any(policy) for policy in [(RETENTION_KEEP_MESSAGES, RETENTION_KEEP_DAYS), *RETENTION_POLICIES.values()])
+
+def _protected_from(context_id, session_id, summaries_enabled, episodes_enabled):
+    """
+    Last message id that may expire without losing it from the summary or episodic
+    memory, or None when neither still needs the session's older messages.
+    """
+    limits = []
+    if summaries_enabled:
+        state = get_summary(context_id, session_id)
+        limits.append(state[1] if state else 0)
+    if episodes_enabled:
+        limits.append(get_episodic_progress(context_id, session_id))
+    return min(limits) if limits else None
+
+# ---------------------------
+# Archive
+# ---------------------------
+
+def _archive_path(context_id, first_id, last_id):
+    context_dir = re.sub(r"[^A-Za-z0-9_.-]", "_", context_id) or "_"
+    return os.path.join(RETENTION_ARCHIVE_DIR, context_dir, f"{first_id:012d}-{last_id:012d}.ndjson.zst")
+
+def write_segment(context_id, rows):
+    """Writes rows to a compressed NDJSON segment and makes it durable before anything is deleted."""
+    path = _archive_path(context_id, rows[0][0], rows[-1][0])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        with zstandard.ZstdCompressor(level=RETENTION_ZSTD_LEVEL).stream_writer(f, closefd=False) as writer:
+            for row in rows:
+                writer.write(to_ndjson(row).encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+    # A rerun after a crash between archive and delete rewrites the same segment
+    os.replace(temp_path, path)
+    return path
+
+# ---------------------------
+# Retention
+# ---------------------------
+
+def expire_session(context_id, session_id, keep_messages, keep_days, protected_from=None):
+    """Archives and deletes a session's messages outside its policy, oldest first. Returns messages deleted."""
+    cutoff = get_retention_cutoff(context_id, session_id, keep_messages, keep_days)
+    if protected_from is not None:
+        cutoff = min(cutoff, protected_from)
+
+    deleted = 0
+    after_id = 0
+    while after_id < cutoff:
+        page = get_messages_page(context_id, session_id, after_id, RETENTION_SEGMENT_ROWS)
+        rows = [row for row in page if row[0] <= cutoff]
+        if not rows:
+            break
+        if RETENTION_ARCHIVE:
+            write_segment(context_id, rows)
+        deleted += delete_messages_range(context_id, session_id, rows[0][0], rows[-1][0])
+        after_id = rows[-1][0]
+    return deleted
+
+def run_retention(summaries_enabled=False, episodes_enabled=False):
+    """
+    Applies the retention policies to every session. Messages the summary or
+    episodic memory have not caught up with yet are kept. Returns
+    {(context_id, session_id): messages deleted} for sessions that lost messages.
+    """
+    expired = {}
+    for context_id, session_id in get_all_sessions():
+        keep_messages, keep_days = policy_for(context_id)
+        if not keep_messages and not keep_days:
+            continue
+        protected_from = _protected_from(context_id, session_id, summaries_enabled, episodes_enabled)
+        count = expire_session(context_id, session_id, keep_messages, keep_days, protected_from)
+        if count:
+            expired[(context_id, session_id)] = count
+    return expired
+
+def vacuum_step(pages=VACUUM_PAGES):
+    """Frees up to `pages` pages when incremental vacuum is on. Returns pages freed."""
+    auto_vacuum, free_pages = get_free_pages()
+    if auto_vacuum != 2 or not free_pages:
+        return 0
+    return free_pages - incremental_vacuum(pages)
+
+# ---------------------------
+# CLI
+# ---------------------------
+
+def enable_incremental_vacuum():
+    """Switches an existing database to incremental auto-vacuum. Rewrites the whole file, so stop the app first."""
+    from memory.connection import get_connection
+    conn = get_connection()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    print(f"auto_vacuum is now {conn.execute('PRAGMA auto_vacuum').fetchone()[0]} (2 = incremental).")
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply message retention policies to the memory database.")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true", help="Convert the database to incremental auto-vacuum (full VACUUM; stop the app first)")
+    parser.add_argument("--ignore-summaries", action="store_true", help="Also expire messages not yet folded into summaries or episodic memory")
+    args = parser.parse_args()
+
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum()
+        return
+
+    if not retention_enabled():
+        print("No retention policy configured (RETENTION_KEEP_MESSAGES, RETENTION_KEEP_DAYS, RETENTION_POLICIES).")
+    else:
+        from memory.episodic import EPISODIC_MEMORY
+        summaries_enabled = os.getenv("MEMORY_MAINTENANCE", "true").lower() == "true"
+        expired = run_retention(
+            summaries_enabled and not args.ignore_summaries,
+            EPISODIC_MEMORY and not args.ignore_summaries,
+        )
+        print(f"Expired {sum(expired.values())} messages from {len(expired)} sessions.")
+
+    freed = 0
+    while True:
+        step = vacuum_step()
+        if not step:
+            break
+        freed += step
+    print(f"Vacuum freed {freed} pages.")
+
+if __name__ == "__main__":
+    main()
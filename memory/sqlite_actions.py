@@ -1,115 +1,457 @@
-import os
 import sqlite3
 
-db_name = "agent_memory.db"
+from memory.connection import get_connection
 
-def get_num_messages_by_id(context_id: str, num_messages: int) -> int:
-    """Fetch the last n messages by context ID from the database."""
+# Session used when a caller does not name one (background tasks, older clients)
+DEFAULT_SESSION_ID = "default"
+
+def get_num_messages_by_id(context_id: str, num_messages: int, session_id: str = DEFAULT_SESSION_ID) -> int:
+    """Fetch the last n messages of a session by context ID from the database."""
     try:
-        db_path = os.path.join(os.path.dirname(__file__), db_name)
-        conn = sqlite3.connect(db_path)
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute('''
             SELECT message, role, created_at FROM messages
-            WHERE context_id = ?
-            ORDER BY created_at DESC, id DESC
+            WHERE context_id = ? AND session_id = ?
+            ORDER BY id DESC
             LIMIT ?
-        ''', (context_id, num_messages))
+        ''', (context_id, session_id, num_messages))
         messages = cursor.fetchall()
         return messages  # List of tuples: (message, role, created_at)
     except sqlite3.Error as e:
         raise Exception(f"An SQLite error occurred: {e}")
     except Exception as e:
-        raise Exception(f"An error occurred while fetching messages: {e}")  
-    finally:
-        if conn:
-            conn.close()
+        raise Exception(f"An error occurred while fetching messages: {e}")
 
-def add_message(context_id: str, message: str, role: str):
-    """Add a new message to the database."""
+def add_message(context_id: str, message: str, role: str, session_id: str = DEFAULT_SESSION_ID, token_count: int = None):
+    """Add a new message to a session in the database."""
     try:
-        db_path = os.path.join(os.path.dirname(__file__), db_name)
-        conn = sqlite3.connect(db_path)
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO messages (context_id, message, role)
-            VALUES (?, ?, ?)
-        ''', (context_id, message, role))
+            INSERT INTO messages (context_id, session_id, message, role, token_count)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (context_id, session_id, message, role, token_count))
         conn.commit()
     except sqlite3.Error as e:
         raise Exception(f"An SQLite error occurred: {e}")
     except Exception as e:
         raise Exception(f"An error occurred while adding a message: {e}")
-    finally:
-        if conn:
-            conn.close()
 
-def get_all_messages():
-    """Fetch all messages from the database."""
+# Columns in the order `SELECT * FROM messages` returns them
+MESSAGE_COLUMNS = ("id", "context_id", "message", "role", "created_at", "session_id", "token_count")
+# Rows read per query when iterating over whole tables
+MESSAGE_PAGE_SIZE = 1000
+
+def get_messages_page(context_id: str = None, session_id: str = None, after_id: int = 0, limit: int = MESSAGE_PAGE_SIZE):
+    """
+    Fetch up to `limit` messages with id greater than `after_id`, oldest first,
+    optionally limited to a context and session. Pass the last id of a page as
+    `after_id` to get the next one (keyset pagination).
+    """
+    conditions = ["id > ?"]
+    params = [after_id]
+    if context_id is not None:
+        # Without a session the history index cannot return ids in order, so walk the
+        # primary key instead ("+" keeps the planner off the index) rather than sort every page
+        conditions.append("context_id = ?" if session_id is not None else "+context_id = ?")
+        params.append(context_id)
+    if session_id is not None:
+        conditions.append("session_id = ?")
+        params.append(session_id)
     try:
-        db_path = os.path.join(os.path.dirname(__file__), db_name)
-        conn = sqlite3.connect(db_path)
+        conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM messages')
-        messages = cursor.fetchall()
-        return messages  # List of tuples: (id, context_id, message, role, created_at)
+        cursor.execute(f'''
+            SELECT {", ".join(MESSAGE_COLUMNS)} FROM messages
+            WHERE {" AND ".join(conditions)}
+            ORDER BY id
+            LIMIT ?
+        ''', (*params, limit))
+        return cursor.fetchall()  # List of tuples in MESSAGE_COLUMNS order
     except sqlite3.Error as e:
         raise Exception(f"An SQLite error occurred: {e}")
     except Exception as e:
-        raise Exception(f"An error occurred while fetching all messages: {e}")
-    finally:
-        if conn:
-            conn.close()
+        raise Exception(f"An error occurred while fetching a page of messages: {e}")
+
+def iter_messages(context_id: str = None, session_id: str = None, after_id: int = 0, page_size: int = MESSAGE_PAGE_SIZE):
+    """
+    Yield messages oldest first, one page at a time, so memory use stays constant
+    however large the table is. Each page is a short read of its own and no read
+    transaction is held between pages, so writers and checkpoints are never held up.
+    """
+    while True:
+        page = get_messages_page(context_id, session_id, after_id, page_size)
+        yield from page
+        if len(page) < page_size:
+            return
+        after_id = page[-1][0]
+
+def get_all_messages():
+    """Fetch all messages from the database. Use iter_messages() for large tables."""
+    return list(iter_messages())  # List of tuples: (id, context_id, message, role, created_at, session_id, token_count)
 
 def get_all_messsages_by_id(context_id: str):
-    """Fetch all messages for a specific context ID."""
+    """Fetch all messages for a specific context ID. Use iter_messages(context_id) for large contexts."""
+    return list(iter_messages(context_id))  # List of tuples: (id, context_id, message, role, created_at, session_id, token_count)
+    
+def clear_messages_by_id(context_id: str, session_id: str = None):
+    """Clear all messages for a specific context ID, or only one of its sessions."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        if session_id is None:
+            cursor.execute('''
+                DELETE FROM messages WHERE context_id = ?
+            ''', (context_id,))
+        else:
+            cursor.execute('''
+                DELETE FROM messages WHERE context_id = ? AND session_id = ?
+            ''', (context_id, session_id))
+        conn.commit()
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while clearing messages: {e}")
+
+def clear_all_messages():
+    """Clear all messages from the database."""
     try:
-        db_path = os.path.join(os.path.dirname(__file__), db_name)
-        conn = sqlite3.connect(db_path)
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM messages')
+        conn.commit()
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while clearing all messages: {e}")
+
+def add_cached_response(cache_key: str, scope: str, message: str, response: str, embedding: str, created_at: float):
+    """Insert or replace a cached response."""
+    try:
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute('''
-            SELECT * FROM messages WHERE context_id = ?
-        ''', (context_id,))
-        messages = cursor.fetchall()
-        return messages  # List of tuples: (id, context_id, message, role, created_at)
+            INSERT OR REPLACE INTO response_cache (cache_key, scope, message, response, embedding, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (cache_key, scope, message, response, embedding, created_at))
+        conn.commit()
     except sqlite3.Error as e:
         raise Exception(f"An SQLite error occurred: {e}")
     except Exception as e:
-        raise Exception(f"An error occurred while fetching messages by context ID: {e}")
-    finally:
-        if conn:
-            conn.close()
-    
-def clear_messages_by_id(context_id: str):
-    """Clear all messages for a specific context ID."""
+        raise Exception(f"An error occurred while caching a response: {e}")
+
+def get_cached_responses(limit: int):
+    """Fetch the most recently cached responses, newest first."""
     try:
-        db_path = os.path.join(os.path.dirname(__file__), db_name)
-        conn = sqlite3.connect(db_path)
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute('''
-            DELETE FROM messages WHERE context_id = ?
-        ''', (context_id,))
+            SELECT cache_key, scope, message, response, embedding, created_at FROM response_cache
+            ORDER BY created_at DESC
+            LIMIT ?
+        ''', (limit,))
+        return cursor.fetchall()  # List of tuples: (cache_key, scope, message, response, embedding, created_at)
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while fetching cached responses: {e}")
+
+def delete_cached_responses(cache_keys):
+    """Delete cached responses by key."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.executemany('DELETE FROM response_cache WHERE cache_key = ?', [(key,) for key in cache_keys])
         conn.commit()
     except sqlite3.Error as e:
         raise Exception(f"An SQLite error occurred: {e}")
     except Exception as e:
-        raise Exception(f"An error occurred while clearing messages: {e}")
-    finally:
-        if conn:
-            conn.close()
+        raise Exception(f"An error occurred while deleting cached responses: {e}")
 
-def clear_all_messages():
-    """Clear all messages from the database."""
+def clear_response_cache():
+    """Clear all cached responses."""
     try:
-        db_path = os.path.join(os.path.dirname(__file__), db_name)
-        conn = sqlite3.connect(db_path)
+        conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM messages')
+        cursor.execute('DELETE FROM response_cache')
         conn.commit()
     except sqlite3.Error as e:
         raise Exception(f"An SQLite error occurred: {e}")
     except Exception as e:
-        raise Exception(f"An error occurred while clearing all messages: {e}")
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        raise Exception(f"An error occurred while clearing the response cache: {e}")
+
+def add_messages(rows):
+    """Add many messages in a single transaction. Rows are (context_id, session_id, message, role, created_at, token_count)."""
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO messages (context_id, session_id, message, role, created_at, token_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while adding messages: {e}")
+
+def get_summary(context_id: str, session_id: str = DEFAULT_SESSION_ID):
+    """Fetch the running summary of a session as (summary, last_message_id), or None."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT summary, last_message_id FROM conversation_summaries
+            WHERE context_id = ? AND session_id = ?
+        ''', (context_id, session_id))
+        return cursor.fetchone()
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while fetching a summary: {e}")
+
+def save_summary(context_id: str, session_id: str, summary: str, last_message_id: int, token_count: int):
+    """Insert or replace the running summary of a session."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO conversation_summaries (context_id, session_id, summary, last_message_id, token_count, updated_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (context_id, session_id, summary, last_message_id, token_count))
+        conn.commit()
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while saving a summary: {e}")
+
+def get_messages_to_summarize(context_id: str, session_id: str, after_id: int, keep_recent: int, limit: int):
+    """
+    Fetch messages after `after_id`, oldest first, that are older than the
+    session's `keep_recent` newest messages. Returns (id, message, role) tuples.
+    """
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id FROM messages
+            WHERE context_id = ? AND session_id = ?
+            ORDER BY id DESC
+            LIMIT 1 OFFSET ?
+        ''', (context_id, session_id, keep_recent))
+        boundary = cursor.fetchone()
+        if not boundary:
+            return []
+        cursor.execute('''
+            SELECT id, message, role FROM messages
+            WHERE context_id = ? AND session_id = ? AND id > ? AND id <= ?
+            ORDER BY id ASC
+            LIMIT ?
+        ''', (context_id, session_id, after_id, boundary[0], limit))
+        return cursor.fetchall()
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while fetching messages to summarize: {e}")
+
+def get_all_sessions():
+    """Fetch every (context_id, session_id) pair that has messages."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT context_id, session_id FROM messages')
+        return cursor.fetchall()
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while fetching sessions: {e}")
+
+def get_episodic_progress(context_id: str, session_id: str = DEFAULT_SESSION_ID) -> int:
+    """Fetch the last message id of a session already embedded into episodic memory (0 if none)."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT last_message_id FROM episodic_progress
+            WHERE context_id = ? AND session_id = ?
+        ''', (context_id, session_id))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while fetching episodic progress: {e}")
+
+def save_episodic_progress(context_id: str, session_id: str, last_message_id: int):
+    """Record how far a session has been embedded into episodic memory."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO episodic_progress (context_id, session_id, last_message_id)
+            VALUES (?, ?, ?)
+        ''', (context_id, session_id, last_message_id))
+        conn.commit()
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while saving episodic progress: {e}")
+
+def get_retention_cutoff(context_id: str, session_id: str, keep_messages: int, keep_days: int) -> int:
+    """
+    Highest message id of a session that falls outside its retention policy (0 if none):
+    everything but the newest `keep_messages`, and everything older than `keep_days` days.
+    A limit of 0 disables that rule.
+    """
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cutoff = 0
+        if keep_messages > 0:
+            cursor.execute('''
+                SELECT id FROM messages
+                WHERE context_id = ? AND session_id = ?
+                ORDER BY id DESC
+                LIMIT 1 OFFSET ?
+            ''', (context_id, session_id, keep_messages))
+            row = cursor.fetchone()
+            cutoff = max(cutoff, row[0] if row else 0)
+        if keep_days > 0:
+            # created_at is UTC, like datetime('now')
+            cursor.execute('''
+                SELECT MAX(id) FROM messages
+                WHERE context_id = ? AND session_id = ? AND created_at < datetime('now', ?)
+            ''', (context_id, session_id, f"-{keep_days} days"))
+            row = cursor.fetchone()
+            cutoff = max(cutoff, row[0] or 0)
+        return cutoff
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while computing a retention cutoff: {e}")
+
+def delete_messages_range(context_id: str, session_id: str, first_id: int, last_id: int) -> int:
+    """Delete a session's messages with ids from first_id to last_id. Returns the number deleted."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM messages
+            WHERE context_id = ? AND session_id = ? AND id BETWEEN ? AND ?
+        ''', (context_id, session_id, first_id, last_id))
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while deleting messages: {e}")
+
+def get_free_pages() -> tuple:
+    """Return (auto_vacuum mode, free pages) of the memory database. Mode 2 is incremental."""
+    try:
+        conn = get_connection()
+        auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        freelist_count = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return auto_vacuum, freelist_count
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+
+def incremental_vacuum(pages: int) -> int:
+    """Return up to `pages` free pages to the file system. Returns the free pages left."""
+    try:
+        conn = get_connection()
+        # The pragma frees one page per step, so the cursor has to be drained
+        conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+        conn.commit()
+        # In WAL mode the file only shrinks once the freed pages are checkpointed
+        conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchall()
+        return conn.execute('PRAGMA freelist_count').fetchone()[0]
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+
+def get_rag_manifest() -> dict:
+    """Fetch the RAG file manifest as {file_path: (size, mtime_ns, sha256)}."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT file_path, size, mtime_ns, sha256 FROM rag_files')
+        return {file_path: (size, mtime_ns, sha256) for file_path, size, mtime_ns, sha256 in cursor}
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while fetching the RAG manifest: {e}")
+
+def get_rag_chunk_ids(file_path: str) -> set:
+    """Fetch the ids of the chunks stored for a RAG file."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT chunk_id FROM rag_chunks WHERE file_path = ?', (file_path,))
+        return {row[0] for row in cursor}
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while fetching RAG chunk ids: {e}")
+
+def save_rag_files(entries):
+    """
+    Record ingested RAG files in one transaction. Entries are
+    (file_path, manifest_row, added_chunk_ids, removed_chunk_ids), where
+    manifest_row is (size, mtime_ns, sha256), or None to leave the manifest as is.
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        for file_path, manifest_row, added, removed in entries:
+            if manifest_row is not None:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO rag_files (file_path, size, mtime_ns, sha256, updated_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (file_path, *manifest_row))
+            cursor.executemany(
+                'DELETE FROM rag_chunks WHERE file_path = ? AND chunk_id = ?',
+                [(file_path, chunk_id) for chunk_id in removed],
+            )
+            cursor.executemany(
+                'INSERT OR IGNORE INTO rag_chunks (file_path, chunk_id) VALUES (?, ?)',
+                [(file_path, chunk_id) for chunk_id in added],
+            )
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while saving the RAG manifest: {e}")
+
+def save_rag_manifest(rows):
+    """Insert or replace manifest entries without touching chunks. Rows are (file_path, size, mtime_ns, sha256)."""
+    save_rag_files([(file_path, (size, mtime_ns, sha256), (), ()) for file_path, size, mtime_ns, sha256 in rows])
+
+def delete_rag_files(file_paths):
+    """Forget RAG files and their chunk inventory in one transaction."""
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany('DELETE FROM rag_files WHERE file_path = ?', [(path,) for path in file_paths])
+        cursor.executemany('DELETE FROM rag_chunks WHERE file_path = ?', [(path,) for path in file_paths])
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while deleting RAG files: {e}")
+
+def clear_rag_manifest():
+    """Forget every ingested RAG file, so the next ingestion processes them all."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM rag_files')
+        cursor.execute('DELETE FROM rag_chunks')
+        conn.commit()
+    except sqlite3.Error as e:
+        raise Exception(f"An SQLite error occurred: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while clearing the RAG manifest: {e}")
@@ -1,46 +1,28 @@
 import sqlite3
 import os
 
+from memory.migrations import run_migrations
+
 def setup_database(db_name="agent_memory.db"):
     conn = None # Initialize connection to None
 
     try:
         db_path = os.path.join(os.path.dirname(__file__), db_name)
         conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
 
         print(f"Successfully connected to database: {db_name}")
 
+        # Let retention return freed pages to the file system bit by bit (see memory/retention.py).
+        # The mode can only be chosen before the first table exists.
+        if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        elif conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            print("Incremental vacuum is off for this database; run `python -m memory.retention --enable-incremental-vacuum` once to enable it.")
+
+        # Create or upgrade the schema (see memory/migrations.py)
+        version = run_migrations(conn)
 
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                context_id TEXT NOT NULL,
-                message TEXT NULL,
-                role TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS processed_files (
-                file_path TEXT PRIMARY KEY,
-                file_hash TEXT NOT NULL
-            );
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS vector_chunks (
-                id INTEGER PRIMARY KEY,
-                file_path TEXT NOT NULL,
-                chunk_text TEXT NOT NULL
-            );
-        ''')
-
-        # Commit the changes to the database
-        conn.commit()
-
-        print("DB setup complete.")
+        print(f"DB setup complete (schema version {version}).")
 
     except sqlite3.Error as e:
         raise Exception(f"An SQLite error occurred: {e}")
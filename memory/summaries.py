@@ -0,0 +1,44 @@
+import asyncio
+from collections import OrderedDict
+
+from memory.sqlite_actions import get_summary, DEFAULT_SESSION_ID
+
+# Summaries are read on every turn but change only when the maintenance task
+# folds more messages, so keep the latest ones in memory
+SUMMARY_CACHE_MAX_SESSIONS = 10000
+
+# (context_id, session_id) -> summary text ("" when the session has none yet).
+# Only touched from the event loop.
+_cache = OrderedDict()
+# Sessions written to since the maintenance task last looked
+_active_sessions = set()
+
+def mark_active(key):
+    _active_sessions.add(key)
+
+def pop_active_sessions():
+    sessions = set(_active_sessions)
+    _active_sessions.clear()
+    return sessions
+
+def set_cached_summary(key, summary):
+    _cache[key] = summary
+    _cache.move_to_end(key)
+    while len(_cache) > SUMMARY_CACHE_MAX_SESSIONS:
+        _cache.popitem(last=False)
+
+async def get_session_summary(context_id, session_id=DEFAULT_SESSION_ID):
+    """Running summary of the session's older messages, or "" if nothing was folded yet."""
+    key = (context_id, session_id)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+    row = await asyncio.to_thread(get_summary, context_id, session_id)
+    summary = row[0] if row else ""
+    set_cached_summary(key, summary)
+    return summary
+
+def invalidate(context_id, session_id=None):
+    """Drops cached summaries after messages or summaries were deleted."""
+    for key in [key for key in _cache if key[0] == context_id and (session_id is None or key[1] == session_id)]:
+        del _cache[key]
@@ -18,7 +18,22 @@ built_in_tools_list = get_built_in_tools()
 
 
 
-def create_system_prompt(rag, being):
+def get_being_tools(being):
+
+    """Returns the built-in tools plus the tools listed in the being file."""
+
+    return built_in_tools_list + being["tools"]
+
+
+
+def create_system_prompt(rag, being, native_tools=False, summary="", episodes=""):
+
+    """
+    Builds the system prompt. With native_tools the tool list and text call
+    protocol are left out, since tools are sent to the provider as schemas.
+    `summary` is the running summary of conversation older than the history,
+    `episodes` are older exchanges of this session relevant to the current message.
+    """
 
     system = being["system"]
 
@@ -30,11 +45,7 @@ def create_system_prompt(rag, being):
 
     example_responses = being["exampleResponses"]
 
-    tools = being["tools"]
-
-
-
-    all_tools = built_in_tools_list + tools
+    all_tools = get_being_tools(being)
 
 
 
@@ -102,6 +113,28 @@ def create_system_prompt(rag, being):
 
 
 
+    if summary:
+
+        prompt += (
+            "\n=== EARLIER IN THIS CONVERSATION ===\n"
+            "Summary of older messages that are no longer shown in full:\n"
+            f"{summary}\n"
+        )
+
+
+
+    if episodes:
+
+        prompt += "\n=== RELEVANT PAST CONVERSATION ===\nEarlier exchanges related to the current message:\n"
+
+        for episode in episodes.split('\n'):
+
+            if episode.strip():
+
+                prompt += f"- {episode.strip()}\n"
+
+
+
     if example_responses:
 
         prompt += "\nEXAMPLE RESPONSES (for style and reference):\n"
@@ -112,6 +145,20 @@ def create_system_prompt(rag, being):
 
     
 
+    if native_tools:
+
+        if all_tools:
+
+            prompt += (
+                "\n=== TOOL USAGE ===\n"
+                "- Call the provided tools whenever they help answer the user; call several at once when a task needs them.\n"
+                "- Use tool results to answer the user's ORIGINAL question in character. Do not acknowledge the data itself.\n"
+            )
+
+        return prompt
+
+
+
     if all_tools:
 
         prompt += "\nTOOLS AVAILABLE:\n"
@@ -7,9 +7,14 @@ from dotenv import load_dotenv
 load_dotenv()
 
 DEFAULT_MODEL_PROVIDER = os.getenv("DEFAULT_AGENT_MODEL_PROVIDER", "openRouter")
+# Comma separated providers tried in order when the primary one fails
+DEFAULT_FALLBACK_PROVIDERS = [p.strip() for p in os.getenv("FALLBACK_MODEL_PROVIDERS", "").split(",") if p.strip()]
 
 default_being = {
     "modelProvider": DEFAULT_MODEL_PROVIDER,
+    "fallbackProviders": DEFAULT_FALLBACK_PROVIDERS,
+    "nativeToolCalling": None,
+    "contextTokenBudget": None,
     "contextId": "default_assistant",
     "system": "You are Jitter AI, a concise, clear, and friendly assistant. Answer directly and avoid unnecessary words. If asked about your identity, say you are Jitter AI. If asked about your abilities, explain that you can answer questions, provide explanations, and help with tasks. You are designed to be user-friendly and approachable. Also explain what the framework is and how to create a being file.",
     "character": {
@@ -45,6 +50,9 @@ def load_being_json(being_name: str = ""):
         character = default_being["character"]
         return {
             "modelProvider": default_being["modelProvider"],
+            "fallbackProviders": default_being["fallbackProviders"],
+            "nativeToolCalling": default_being["nativeToolCalling"],
+            "contextTokenBudget": default_being["contextTokenBudget"],
             "contextId": default_being["contextId"],
             "system": default_being["system"],
             "name": character["name"],
@@ -67,6 +75,9 @@ def load_being_json(being_name: str = ""):
 
             # Extract all top-level fields
             model_provider = data.get("modelProvider")
+            fallback_providers = data.get("fallbackProviders", DEFAULT_FALLBACK_PROVIDERS)
+            native_tool_calling = data.get("nativeToolCalling")  # None = use NATIVE_TOOL_CALLING
+            context_token_budget = data.get("contextTokenBudget")  # None = use CONTEXT_TOKEN_BUDGET
             contxt_id = data.get("contextId", "")
             system = data.get("system")
             character = data.get("character", {})
@@ -97,6 +108,9 @@ def load_being_json(being_name: str = ""):
 
             return {
                 "modelProvider": model_provider,
+                "fallbackProviders": fallback_providers,
+                "nativeToolCalling": native_tool_calling,
+                "contextTokenBudget": context_token_budget,
                 "contextId": contxt_id or str(context_id),
                 "system": system,
                 "name": name,
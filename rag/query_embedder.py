@@ -0,0 +1,86 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from utils import metrics
+
+# ---------------------------
+# Config
+# ---------------------------
+
+# Embed queries from concurrent requests in one forward pass instead of one each
+RAG_QUERY_BATCHING = os.getenv("RAG_QUERY_BATCHING", "true").lower() == "true"
+# How long the first query of a batch waits for others to join it
+RAG_QUERY_BATCH_WAIT_MS = float(os.getenv("RAG_QUERY_BATCH_WAIT_MS", 5))
+RAG_QUERY_BATCH_MAX = int(os.getenv("RAG_QUERY_BATCH_MAX", 32))
+
+_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+# ---------------------------
+# Batcher
+# ---------------------------
+
+def _embed(texts):
+    # Imported here: rag_system imports this module
+    from rag.rag_system import get_embedding_fn
+    return get_embedding_fn()(texts)
+
+def _run_batch(batch):
+    # Identical queries in a batch (e.g. the same message from several clients) are embedded once
+    texts = list(dict.fromkeys(text for text, _ in batch))
+    try:
+        vectors = dict(zip(texts, _embed(texts)))
+    except Exception as e:
+        for _, future in batch:
+            future.set_exception(e)
+        return
+    for text, future in batch:
+        future.set_result(vectors[text])
+
+    metrics.increment("rag.query_batches")
+    metrics.observe("rag.query_batch_size", len(batch))
+
+def _worker_loop():
+    interval = RAG_QUERY_BATCH_WAIT_MS / 1000
+    while True:
+        batch = [_queue.get()]
+        # Gather queries for up to one interval or RAG_QUERY_BATCH_MAX queries
+        deadline = time.monotonic() + interval
+        while len(batch) < RAG_QUERY_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _run_batch(batch)
+
+def _ensure_worker():
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = threading.Thread(target=_worker_loop, name="jitter-query-embedder", daemon=True)
+                _worker.start()
+
+# ---------------------------
+# Public API
+# ---------------------------
+
+def embed_query(text):
+    """
+    Embedding of one query with the RAG model. Blocks the calling thread; with
+    RAG_QUERY_BATCHING, concurrent callers share a batched forward pass.
+    """
+    if not RAG_QUERY_BATCHING:
+        return _embed([text])[0]
+
+    _ensure_worker()
+    future = Future()
+    _queue.put((text, future))
+    return future.result()
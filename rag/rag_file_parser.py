@@ -1,4 +1,5 @@
 import csv
+import hashlib
 import re
 from bs4 import BeautifulSoup
 import PyPDF2
@@ -138,4 +139,43 @@ def md_file_rag(md_file_path: str) -> list:
         chunk_tokens = tokens[i:i+max_tokens]
         chunk_text = enc.decode(chunk_tokens)
         chunks.append(chunk_text)
-    return chunks
\ No newline at end of file
+    return chunks
+# === Dispatch ===
+def get_chunks_from_file(file_path):
+    if file_path.endswith('.txt'):
+        return text_file_rag(file_path)
+    elif file_path.endswith('.pdf'):
+        return pdf_file_rag(file_path)
+    elif file_path.endswith('.html') or file_path.endswith('.htm'):
+        return html_file_rag(file_path)
+    elif file_path.endswith('.csv'):
+        return csv_file_rag(file_path)
+    elif file_path.endswith('.md'):
+        return md_file_rag(file_path)
+    else:
+        print(f"[get_chunks_from_file] Unsupported file type: {file_path}")
+        return []
+
+HASH_READ_SIZE = 1024 * 1024
+
+def hash_file(path):
+    """SHA-256 of a file, read in blocks so large files are never held in memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def parse_file(file_path: str, known_hash: str = None) -> tuple:
+    """
+    Ingestion worker: hashes and chunks one file. Runs in a process pool, so it
+    only uses this module. Returns (file_path, file_hash, chunks, error); chunks
+    is None when the content still matches `known_hash` (e.g. only the mtime changed).
+    """
+    try:
+        file_hash = hash_file(file_path)
+        if file_hash == known_hash:
+            return file_path, file_hash, None, None
+        return file_path, file_hash, get_chunks_from_file(file_path), None
+    except Exception as e:
+        return file_path, None, None, str(e)
@@ -1,12 +1,16 @@
 import os
 import re
 import hashlib
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from typing import List
-from sentence_transformers import SentenceTransformer
-from chromadb import PersistentClient
-from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
 
-from rag.rag_file_parser import text_file_rag, pdf_file_rag, html_file_rag, csv_file_rag, md_file_rag
+from rag.query_embedder import embed_query
+from rag.rag_file_parser import get_chunks_from_file, hash_file, parse_file
+from memory.sqlite_actions import get_rag_manifest, save_rag_manifest, get_rag_chunk_ids, save_rag_files, delete_rag_files
+from utils.startup_timing import timed
 
 # ---------------------------
 # Config
@@ -14,54 +18,162 @@ from rag.rag_file_parser import text_file_rag, pdf_file_rag, html_file_rag, csv_
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FILES_DIR = os.path.join(BASE_DIR, 'files')
+# Manifest of earlier versions; imported into the rag_files table on the next ingestion
 HASH_STORE = os.path.join(BASE_DIR, 'processed_files.txt')
 CHROMA_DIR = os.path.join(BASE_DIR, ".chromadb")
 
-print("[RAG] Loading embedding model...")
+# Processes parsing and chunking files during ingestion; 1 parses in this process
+RAG_INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS") or os.cpu_count() or 1)
+# Chunks embedded and written per collection.add call
+RAG_EMBED_BATCH = int(os.getenv("RAG_EMBED_BATCH", 256))
+# ingest_data runs in a thread of the live server, next to the event loop's executor,
+# the memory writer, the query batcher and torch threads. Forking a threaded process can
+# deadlock the children on locks another thread held, so workers come from a forkserver
+# (spawn where it is unavailable). Workers only run rag_file_parser.parse_file; besides it,
+# multiprocessing re-runs the main script in each of them, which no longer loads the
+# embedding model (see get_embedding_fn), so starting workers stays cheap.
+RAG_INGEST_START_METHOD = os.getenv(
+    "RAG_INGEST_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn",
+)
+INGEST_PROGRESS_SECONDS = 5
+
 EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
-embedding_fn = SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL_NAME)
 
-print("[RAG] Initializing Chroma client...")
-client = PersistentClient(path=CHROMA_DIR)
-collection = client.get_or_create_collection(name="rag_chunks", embedding_function=embedding_fn)
+# ---------------------------
+# Lazy initialization
+# ---------------------------
+# The embedding model (torch) and Chroma are loaded on first use or by warm_up(),
+# so importing this module stays cheap for the app, tasks and CLI scripts.
+
+_init_lock = threading.RLock()
+_embedding_fn = None
+_client = None
+_collection = None
+
+def get_embedding_fn():
+    global _embedding_fn
+    if _embedding_fn is None:
+        with _init_lock:
+            if _embedding_fn is None:
+                print("[RAG] Loading embedding model...")
+                with timed("rag.embedding_model"):
+                    from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
+                    _embedding_fn = SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL_NAME)
+    return _embedding_fn
+
+def get_client():
+    global _client
+    if _client is None:
+        with _init_lock:
+            if _client is None:
+                print("[RAG] Initializing Chroma client...")
+                with timed("rag.chroma_client"):
+                    from chromadb import PersistentClient
+                    _client = PersistentClient(path=CHROMA_DIR)
+    return _client
+
+def get_collection():
+    global _collection
+    if _collection is None:
+        with _init_lock:
+            if _collection is None:
+                _collection = get_client().get_or_create_collection(name="rag_chunks", embedding_function=get_embedding_fn())
+    return _collection
+
+_warmed_up = False
+
+def is_ready():
+    return _warmed_up
+
+def warm_up():
+    """Loads the embedding model and Chroma and runs one embedding, so the first search is not slow."""
+    global _warmed_up
+    collection = get_collection()
+    with _init_lock:
+        if not _warmed_up:
+            with timed("rag.first_embedding"):
+                get_embedding_fn()(["warm-up"])
+            _warmed_up = True
+    return collection
 
 # ---------------------------
 # Utility Functions
 # ---------------------------
 
-def hash_file(path):
-    with open(path, "rb") as f:
-        return hashlib.sha256(f.read()).hexdigest()
-
 def make_chunk_id(source_id, chunk):
     return hashlib.sha256(f"{source_id}-{chunk}".encode()).hexdigest()
 
-def get_chunks_from_file(file_path):
-    if file_path.endswith('.txt'):
-        return text_file_rag(file_path)
-    elif file_path.endswith('.pdf'):
-        return pdf_file_rag(file_path)
-    elif file_path.endswith('.html') or file_path.endswith('.htm'):
-        return html_file_rag(file_path)
-    elif file_path.endswith('.csv'):
-        return csv_file_rag(file_path)
-    elif file_path.endswith('.md'):
-        return md_file_rag(file_path)
-    else:
-        print(f"[get_chunks_from_file] Unsupported file type: {file_path}")
-        return []
-
-def load_processed_hashes():
+def import_legacy_manifest():
+    """Moves processed_files.txt (path:hash lines) into the sqlite manifest, once."""
     if not os.path.exists(HASH_STORE):
-        return {}
+        return
+    rows = []
     with open(HASH_STORE, "r") as f:
-        lines = f.read().splitlines()
-    return dict(line.split(":", 1) for line in lines)
+        for line in f.read().splitlines():
+            # Hashes never contain ":", paths may
+            file_path, _, file_hash = line.rpartition(":")
+            if file_path and file_hash:
+                # No size/mtime: each file is hashed once more, but not re-parsed if unchanged
+                rows.append((file_path, None, None, file_hash))
+    save_rag_manifest(rows)
+    os.remove(HASH_STORE)
+    print(f"[ingest_data] Imported {len(rows)} entries from {os.path.basename(HASH_STORE)} into the manifest.")
+
+def _list_files(paths=None):
+    """(path, stat) of the files directly in the files directory, or of those among `paths`."""
+    if paths is None:
+        with os.scandir(FILES_DIR) as entries:
+            return [(entry.path, entry.stat()) for entry in entries if entry.is_file()]
+    files = []
+    for file_path in paths:
+        if os.path.dirname(file_path) == FILES_DIR and os.path.isfile(file_path):
+            files.append((file_path, os.stat(file_path)))
+    return files
+
+def scan_files(manifest, paths=None):
+    """
+    Lists the files directory, or only `paths` (e.g. from the file watcher).
+    Returns (changed, unchanged_count, deleted) where changed maps each new or
+    modified file to its (size, mtime_ns) and deleted lists manifest files that
+    are gone; unchanged files are not read.
+    """
+    changed = {}
+    unchanged = 0
+    seen = set()
+    for file_path, stat in _list_files(paths):
+        seen.add(file_path)
+        known = manifest.get(file_path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            unchanged += 1
+        else:
+            changed[file_path] = (stat.st_size, stat.st_mtime_ns)
+    candidates = manifest if paths is None else [file_path for file_path in paths if file_path in manifest]
+    return changed, unchanged, [file_path for file_path in candidates if file_path not in seen]
 
-def save_processed_hashes(file_hashes):
-    with open(HASH_STORE, "w") as f:
-        for path, file_hash in file_hashes.items():
-            f.write(f"{path}:{file_hash}\n")
+def stored_chunk_ids(file_path, in_manifest=True):
+    """Ids of a file's chunks in the collection. Files ingested before the chunk inventory existed are looked up in Chroma."""
+    chunk_ids = get_rag_chunk_ids(file_path)
+    if not chunk_ids and in_manifest:
+        chunk_ids = set(get_collection().get(where={"file_path": file_path}, include=[])["ids"])
+    return chunk_ids
+
+def purge_deleted_files(file_paths):
+    """Deletes the chunks of files removed from the files directory. Returns chunks deleted."""
+    removed = 0
+    purged = []
+    for file_path in file_paths:
+        try:
+            chunk_ids = stored_chunk_ids(file_path)
+            if chunk_ids:
+                get_collection().delete(ids=list(chunk_ids))
+            removed += len(chunk_ids)
+            purged.append(file_path)
+        except Exception as e:
+            print(f"[ingest_data] Error removing chunks of deleted file {file_path}: {e}")
+    if purged:
+        delete_rag_files(purged)
+    return removed
 
 # ---------------------------
 # Add Chunks Manually
@@ -76,7 +188,7 @@ def add_chunks_to_db(chunks: List[str], source_id: str = "manual"):
     metadatas = [{"source": source_id} for _ in chunks]
 
     try:
-        collection.add(documents=chunks, metadatas=metadatas, ids=ids)
+        get_collection().add(documents=chunks, metadatas=metadatas, ids=ids)
         print(f"[add_chunks_to_db] Added {len(chunks)} chunks from '{source_id}' to the collection.")
     except Exception as e:
         print(f"[add_chunks_to_db] Error adding chunks: {e}")
@@ -85,49 +197,190 @@ def add_chunks_to_db(chunks: List[str], source_id: str = "manual"):
 # Ingest Files from Folder
 # ---------------------------
 
-def ingest_data():
+# Counters of the ingestion in progress (or the last one), read by GET /rag/status
+ingest_progress = {"files_total": 0, "files_done": 0, "chunks_embedded": 0, "chunks_removed": 0}
+
+def _pool_context():
+    context = multiprocessing.get_context(RAG_INGEST_START_METHOD)
+    if RAG_INGEST_START_METHOD == "forkserver":
+        # Workers fork from a server that has imported the parsers and nothing else of the app
+        context.set_forkserver_preload(["rag.rag_file_parser"])
+    return context
+
+def _parse_files(files_to_process, known_hashes):
+    """Yields parse_file results as they complete, using a process pool when it helps."""
+    workers = min(RAG_INGEST_WORKERS, len(files_to_process))
+    if workers <= 1:
+        for file_path in files_to_process:
+            yield parse_file(file_path, known_hashes.get(file_path))
+        return
+
+    remaining_files = iter(files_to_process)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as pool:
+        # Keep a bounded number of files in flight so parsed chunks never pile up ahead of embedding
+        in_flight = {}
+        while True:
+            for file_path in remaining_files:
+                in_flight[pool.submit(parse_file, file_path, known_hashes.get(file_path))] = file_path
+                if len(in_flight) >= workers * 4:
+                    break
+            if not in_flight:
+                return
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # e.g. a worker process died
+                    result = (file_path, None, None, str(e))
+                yield result
+
+def ingest_data(paths=None):
+    """
+    Indexes new and changed files in the files directory. Files whose size and
+    mtime match the manifest are skipped without being read; the rest are
+    hashed, parsed and chunked in a pool of RAG_INGEST_WORKERS processes, and
+    this process embeds and writes the chunks in batches of RAG_EMBED_BATCH.
+    Only chunks new to a file are embedded; its stale chunks, and the chunks
+    of deleted files, are removed from the collection. `paths` limits the run
+    to those files. Progress is published in `ingest_progress`.
+    """
     if not os.path.exists(FILES_DIR):
         print(f"[ingest_data] Directory '{FILES_DIR}' does not exist.")
         return
 
-    files_to_process = [os.path.join(FILES_DIR, f) for f in os.listdir(FILES_DIR)]
-    print(f"\n[ingest_data] Found files: {[os.path.basename(f) for f in files_to_process]}")
+    collection = get_collection()
+    started = time.perf_counter()
+    import_legacy_manifest()
+    manifest = get_rag_manifest()
+    changed, unchanged, deleted = scan_files(manifest, paths)
+    print(f"\n[ingest_data] Found {len(changed) + unchanged} files, {len(changed)} new or modified, {len(deleted)} deleted.")
 
-    processed_hashes = load_processed_hashes()
-    updated_hashes = processed_hashes.copy()
+    last_report = started
+    parsed = skipped = failed = chunks_added = chunks_removed = 0
+    ingest_progress.update(files_total=len(changed), files_done=0, chunks_embedded=0, chunks_removed=0)
+    if deleted:
+        chunks_removed += purge_deleted_files(deleted)
+    # chunk id -> (document, metadata), in arrival order; duplicate chunks of a file collapse into one id
+    batch = {}
+    # file path -> (file hash, new chunks still waiting in the batch, all chunk ids, stale chunk ids)
+    pending_files = {}
+    # Manifest and chunk inventory changes of files that are fully stored, written after each batch
+    file_entries = []
 
-    for file_path in files_to_process:
+    def save_manifest():
         try:
-            file_hash = hash_file(file_path)
-            if processed_hashes.get(file_path) == file_hash:
-                continue  # Skip unchanged
+            save_rag_files(file_entries)
+        except Exception as e:
+            # The files are processed again next time; their chunk ids are stable, so nothing is duplicated
+            print(f"[ingest_data] Error saving the manifest: {e}")
+        file_entries.clear()
+
+    def processed(file_path, file_hash, chunk_ids=(), stale_ids=()):
+        """Deletes the file's stale chunks now that its new ones are stored, and queues its manifest update."""
+        nonlocal chunks_removed
+        manifest_row = (*changed[file_path], file_hash)
+        if stale_ids:
+            try:
+                collection.delete(ids=list(stale_ids))
+                chunks_removed += len(stale_ids)
+            except Exception as e:
+                print(f"[ingest_data] Error removing stale chunks of {file_path}: {e}")
+                # Keep the stale ids in the inventory and the old manifest row, so the next run retries
+                manifest_row, stale_ids = None, ()
+        file_entries.append((file_path, manifest_row, chunk_ids, stale_ids))
 
-            print(f"[ingest_data] Processing: {file_path}")
-            chunks = get_chunks_from_file(file_path)
-            if not chunks:
+    def flush(final=False):
+        """Writes full batches (and the remainder when final); a file counts as processed once all its chunks are stored."""
+        nonlocal chunks_added, failed
+        while len(batch) >= RAG_EMBED_BATCH or (final and batch):
+            batch_ids = list(batch)[:RAG_EMBED_BATCH]
+            documents, metadatas = zip(*(batch.pop(chunk_id) for chunk_id in batch_ids))
+            batch_files = {metadata["file_path"] for metadata in metadatas}
+            try:
+                collection.add(ids=batch_ids, documents=list(documents), metadatas=list(metadatas))
+            except Exception as e:
+                print(f"[ingest_data] Error adding {len(batch_ids)} chunks from {len(batch_files)} files: {e}")
+                # Drop the files' remaining chunks too; they are retried on the next ingestion
+                for chunk_id in [chunk_id for chunk_id, (_, metadata) in batch.items() if metadata["file_path"] in batch_files]:
+                    del batch[chunk_id]
+                for file_path in batch_files:
+                    if pending_files.pop(file_path, None):
+                        failed += 1
                 continue
+            chunks_added += len(batch_ids)
+            for metadata in metadatas:
+                file_path = metadata["file_path"]
+                file_hash, remaining, chunk_ids, stale_ids = pending_files[file_path]
+                if remaining == 1:
+                    processed(file_path, file_hash, chunk_ids, stale_ids)
+                    del pending_files[file_path]
+                else:
+                    pending_files[file_path] = (file_hash, remaining - 1, chunk_ids, stale_ids)
+            save_manifest()
 
-            ids = [make_chunk_id(file_path, chunk) for chunk in chunks]
-            metadatas = [{"file_path": file_path} for _ in chunks]
+    known_hashes = {file_path: manifest[file_path][2] for file_path in changed if file_path in manifest}
+    for file_path, file_hash, chunks, error in _parse_files(list(changed), known_hashes):
+        ingest_progress.update(files_done=parsed + skipped + failed, chunks_embedded=chunks_added, chunks_removed=chunks_removed)
+        now = time.perf_counter()
+        if now - last_report >= INGEST_PROGRESS_SECONDS:
+            last_report = now
+            done = parsed + skipped + failed
+            print(f"[ingest_data] {done}/{len(changed)} files, {chunks_added} chunks embedded ({now - started:.0f}s)")
 
-            collection.add(documents=chunks, metadatas=metadatas, ids=ids)
-            updated_hashes[file_path] = file_hash
+        if error:
+            print(f"[ingest_data] Error processing {file_path}: {error}")
+            failed += 1
+        elif chunks is None:
+            # Touched but identical: only the stat in the manifest changes
+            skipped += 1
+            processed(file_path, file_hash)
+        elif not chunks and file_path not in manifest:
+            # Empty or unsupported: recorded without chunks, so it is skipped by stat next time
+            skipped += 1
+            processed(file_path, file_hash)
+        else:
+            parsed += 1
+            file_chunks = {make_chunk_id(file_path, chunk): chunk for chunk in chunks}
+            try:
+                old_ids = stored_chunk_ids(file_path, file_path in manifest)
+            except Exception as e:
+                print(f"[ingest_data] Error reading the chunk inventory of {file_path}: {e}")
+                failed += 1
+                continue
+            # Chunk ids are content hashes: only chunks that are new to the file are embedded
+            new_ids = [chunk_id for chunk_id in file_chunks if chunk_id not in old_ids]
+            stale_ids = old_ids - file_chunks.keys()
+            if not new_ids:
+                processed(file_path, file_hash, tuple(file_chunks), stale_ids)
+                continue
+            for chunk_id in new_ids:
+                batch[chunk_id] = (file_chunks[chunk_id], {"file_path": file_path})
+            pending_files[file_path] = (file_hash, len(new_ids), tuple(file_chunks), stale_ids)
+            flush()
 
-        except Exception as e:
-            print(f"[ingest_data] Error processing {file_path}: {e}")
+    flush(final=True)
+    save_manifest()
+    ingest_progress.update(files_done=parsed + skipped + failed, chunks_embedded=chunks_added, chunks_removed=chunks_removed)
 
-    save_processed_hashes(updated_hashes)
-    print(f"[ingest_data] Ingestion complete. Collection now contains {collection.count()} documents.\n")
+    print(
+        f"[ingest_data] Ingestion complete in {time.perf_counter() - started:.1f}s: {parsed} files parsed, "
+        f"{unchanged + skipped} unchanged or empty, {failed} failed, {chunks_added} chunks embedded, {chunks_removed} stale chunks removed. "
+        f"Collection now contains {collection.count()} documents.\n"
+    )
 
 # ---------------------------
 # Search Function
 # ---------------------------
 
 def search_rag(query: str, top_k: int = 20):
+    collection = get_collection()
     if collection.count() == 0:
         return "Knowledge base is empty. Add files to the 'files' directory and run ingestion."
 
-    results = collection.query(query_texts=[query], n_results=top_k)
+    # Embedded by the query batcher, shared with concurrent searches
+    results = collection.query(query_embeddings=[embed_query(query)], n_results=top_k)
     documents = results.get("documents", [[]])[0]
     if not documents:
         return "No relevant information found."
@@ -4,7 +4,7 @@ import random
 from fastapi import FastAPI
 
 from core.agent import get_ai_response
-from memory.sqlite_actions import get_num_messages_by_id
+from memory.message_log import recent_messages
 from rag.rag_system import search_rag
 
 FEELINGS = [
@@ -38,7 +38,7 @@ async def agent_live(app: FastAPI):
 
             being = app.state.being
 
-            last_messages = get_num_messages_by_id(being["contextId"], 5)
+            last_messages = await recent_messages(being["contextId"], 5)
 
             prompt = (
                 f"Last 5 messages:\n"
@@ -51,7 +51,7 @@ async def agent_live(app: FastAPI):
             )
 
             # rag_context = search_rag(prompt, top_k=3)
-            response = get_ai_response(being, "", prompt)
+            response = await get_ai_response(being, "", prompt)
     
             if not response:
                 raise ValueError("AI response was empty")
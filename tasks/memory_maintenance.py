@@ -0,0 +1,179 @@
+import asyncio
+import os
+import re
+import time
+
+from fastapi import FastAPI
+
+from core.agent import call_model
+from core.context_builder import count_tokens
+from core.provider_chain import call_with_fallback
+from memory import episodic, history_cache, retention, summaries
+from memory.message_log import idle_seconds
+from memory.sqlite_actions import get_summary, save_summary, get_messages_to_summarize, get_all_sessions
+from tools.handle_tool_call import is_tool_call
+from utils import metrics
+from utils.enums import Numbers, Role
+
+# ---------------------------
+# Config
+# ---------------------------
+
+MEMORY_MAINTENANCE = os.getenv("MEMORY_MAINTENANCE", "true").lower() == "true"
+SUMMARY_INTERVAL = float(os.getenv("SUMMARY_INTERVAL", 60))  # seconds between compaction passes
+# extractive: condense each message to its first sentence, no model call
+# model: ask the being's model to rewrite the summary (falls back to extractive on errors)
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "extractive").lower()
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", 400))
+SUMMARY_MIN_BATCH = int(os.getenv("SUMMARY_MIN_BATCH", 10))  # fold only once this many messages left the window
+SUMMARY_MAX_FOLD = int(os.getenv("SUMMARY_MAX_FOLD", 500))  # messages folded per session per pass
+SUMMARY_LINE_CHARS = 160
+
+# Messages still sent in full; everything older is folded into the summary
+KEEP_RECENT = Numbers.MAX_MESSAGES.value
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation. Merge the new messages into the "
+    "current summary. Keep names, facts, decisions, preferences and open questions; drop "
+    "small talk and raw tool output. Answer with the summary only, as short bullet lines."
+)
+
+# ---------------------------
+# Summaries
+# ---------------------------
+
+def _first_sentence(text):
+    text = " ".join((text or "").split())
+    sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+    return sentence if len(sentence) <= SUMMARY_LINE_CHARS else sentence[:SUMMARY_LINE_CHARS - 3].rstrip() + "..."
+
+def _extract_line(message, role, name):
+    if role == Role.USER.value:
+        return f"- User: {_first_sentence(message)}"
+    if role == Role.TOOL.value:
+        return f"- Tool result: {_first_sentence(message)}"
+    tool_calls = is_tool_call(message or "")
+    if tool_calls:
+        return f"- {name} used: {', '.join(tool_name for tool_name, _ in tool_calls)}"
+    return f"- {name}: {_first_sentence(message)}"
+
+def _trim_summary(summary):
+    """Drops the oldest lines until the summary fits SUMMARY_MAX_TOKENS."""
+    lines = [line for line in summary.split("\n") if line.strip()]
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > SUMMARY_MAX_TOKENS:
+        lines.pop(0)
+    return "\n".join(lines)
+
+def extractive_summary(previous, rows, name):
+    lines = [_extract_line(message, role, name) for _, message, role in rows]
+    return _trim_summary("\n".join(filter(None, [previous] + lines)))
+
+async def model_summary(being, previous, rows):
+    transcript = "\n".join(f"{role}: {message}" for _, message, role in rows)
+    prompt = f"Current summary:\n{previous or '(empty)'}\n\nNew messages:\n{transcript}"
+    summary, _ = await call_with_fallback(
+        being,
+        lambda provider: call_model(provider, SUMMARY_SYSTEM_PROMPT, prompt, "", []),
+    )
+    return _trim_summary(summary.strip())
+
+async def compact_session(being, context_id, session_id):
+    """Folds a session's messages that left the history window into its summary. Returns messages folded."""
+    state = await asyncio.to_thread(get_summary, context_id, session_id)
+    previous, last_message_id = state if state else ("", 0)
+
+    rows = await asyncio.to_thread(
+        get_messages_to_summarize, context_id, session_id, last_message_id, KEEP_RECENT, SUMMARY_MAX_FOLD
+    )
+    if len(rows) < SUMMARY_MIN_BATCH:
+        return 0
+
+    summary = None
+    if SUMMARY_MODE == "model":
+        try:
+            summary = await model_summary(being, previous, rows)
+        except Exception as e:
+            print(f"[MEMORY] Model summary failed for {context_id}/{session_id} ({e}); using extractive summary.")
+    if not summary:
+        summary = await asyncio.to_thread(extractive_summary, previous, rows, being.get("name") or "Assistant")
+
+    token_count = count_tokens(summary)
+    await asyncio.to_thread(save_summary, context_id, session_id, summary, rows[-1][0], token_count)
+    summaries.set_cached_summary((context_id, session_id), summary)
+    metrics.increment("memory.messages_summarized", len(rows))
+    return len(rows)
+
+# ---------------------------
+# Background task
+# ---------------------------
+
+async def memory_maintenance(app: FastAPI):
+    """
+    Background task that keeps prompts bounded: messages older than the
+    history window are folded into per-session summaries, off the request path.
+    With EPISODIC_MEMORY the same messages are also embedded for retrieval.
+    """
+    # Look at every session once after startup, then only at sessions that got new messages
+    try:
+        sessions = set(await asyncio.to_thread(get_all_sessions))
+    except Exception as e:
+        print(f"ERROR:    memory_maintenance could not list sessions: {e}")
+        sessions = set()
+    while True:
+        being = app.state.being
+        folded = 0
+        indexed = 0
+        for context_id, session_id in sessions:
+            try:
+                count = await compact_session(being, context_id, session_id)
+                embedded = await asyncio.to_thread(
+                    episodic.index_session, context_id, session_id, being.get("name") or "Assistant"
+                )
+            except Exception as e:
+                print(f"ERROR:    An error occurred in memory_maintenance for {context_id}/{session_id}: {e}")
+                continue
+            folded += count
+            indexed += embedded
+            if count >= SUMMARY_MAX_FOLD or embedded * 2 >= episodic.EPISODIC_BATCH:
+                # More backlog than one pass handles; come back next time
+                summaries.mark_active((context_id, session_id))
+        if folded:
+            print(f"[MEMORY] Folded {folded} messages from {len(sessions)} sessions into summaries.")
+        if indexed:
+            print(f"[MEMORY] Embedded {indexed} past turns into episodic memory.")
+
+        await asyncio.sleep(SUMMARY_INTERVAL)
+        sessions = summaries.pop_active_sessions()
+
+async def memory_retention(app: FastAPI):
+    """
+    Background task that keeps the memory database bounded: applies the
+    retention policies every RETENTION_INTERVAL seconds and, in between,
+    returns freed pages to the file system while no messages are coming in.
+    """
+    while True:
+        try:
+            expired = await asyncio.to_thread(
+                retention.run_retention, MEMORY_MAINTENANCE, episodic.EPISODIC_MEMORY
+            )
+            for context_id, session_id in expired:
+                history_cache.invalidate(context_id, session_id)
+            if expired:
+                count = sum(expired.values())
+                metrics.increment("memory.messages_expired", count)
+                print(f"[MEMORY] Archived and deleted {count} messages from {len(expired)} sessions.")
+        except Exception as e:
+            print(f"ERROR:    An error occurred in memory_retention: {e}")
+
+        next_pass = time.monotonic() + retention.RETENTION_INTERVAL
+        while time.monotonic() < next_pass:
+            freed = 0
+            if idle_seconds() >= retention.VACUUM_IDLE_SECONDS:
+                try:
+                    freed = await asyncio.to_thread(retention.vacuum_step)
+                except Exception as e:
+                    print(f"ERROR:    Incremental vacuum failed: {e}")
+                if freed:
+                    metrics.increment("memory.pages_vacuumed", freed)
+            # Keep vacuuming in small steps while pages are freed, otherwise check back later
+            await asyncio.sleep(0.1 if freed else min(retention.VACUUM_IDLE_SECONDS, 10))
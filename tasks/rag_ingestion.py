@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+
+from rag import rag_system
+from utils import metrics, startup_timing
+
+# ---------------------------
+# Config
+# ---------------------------
+
+# Watch rag/files and ingest new, changed and deleted files while the server runs
+RAG_WATCH = os.getenv("RAG_WATCH", "true").lower() == "true"
+# Changes are collected for this long after the last one before a job is queued (e.g. while copying many files)
+RAG_WATCH_DEBOUNCE_MS = int(os.getenv("RAG_WATCH_DEBOUNCE_MS", 2000))
+
+# Jobs are a set of file paths, or None for a scan of the whole directory.
+# Ingestion itself is incremental, so queued jobs are merged before each run.
+_jobs = None
+_status = {
+    "running": False,
+    "current_job": None,
+    "jobs_completed": 0,
+    "last_started_at": None,
+    "last_finished_at": None,
+    "last_duration_seconds": None,
+    "last_error": None,
+    "watching": False,
+}
+
+# ---------------------------
+# Queue
+# ---------------------------
+
+def _queue():
+    # Created on first use so it belongs to the server's event loop
+    global _jobs
+    if _jobs is None:
+        _jobs = asyncio.Queue()
+    return _jobs
+
+def enqueue(paths=None):
+    """Queues ingestion of `paths`, or of the whole files directory when None."""
+    _queue().put_nowait(set(paths) if paths is not None else None)
+
+def _merge_queued(job):
+    """Takes every job waiting in the queue and merges them into `job`."""
+    while not _queue().empty():
+        queued = _queue().get_nowait()
+        job = None if job is None or queued is None else job | queued
+    return job
+
+def status():
+    return {
+        **_status,
+        "ready": rag_system.is_ready(),
+        "queue_depth": _jobs.qsize() if _jobs is not None else 0,
+        "progress": dict(rag_system.ingest_progress),
+    }
+
+# ---------------------------
+# Background tasks
+# ---------------------------
+
+async def rag_ingestion():
+    """
+    Background task that runs queued ingestion jobs one at a time, off the
+    event loop. search_rag keeps serving from the existing index meanwhile.
+    """
+    first_job = True
+    while True:
+        job = _merge_queued(await _queue().get())
+        _status.update(
+            running=True,
+            current_job="full scan" if job is None else f"{len(job)} files",
+            last_started_at=time.time(),
+            last_error=None,
+        )
+        started = time.perf_counter()
+        try:
+            # No-op once the model is loaded (see RAG_WARMUP_BACKGROUND)
+            await asyncio.to_thread(rag_system.warm_up)
+            await asyncio.to_thread(rag_system.ingest_data, None if job is None else sorted(job))
+        except Exception as e:
+            print(f"ERROR:    An error occurred in rag_ingestion: {e}")
+            _status["last_error"] = str(e)
+        duration = time.perf_counter() - started
+        if first_job:
+            startup_timing.record("rag.ingest", duration)
+            print(f"[STARTUP] RAG ready ({startup_timing.format_report()})")
+            first_job = False
+        metrics.increment("rag.ingestion_jobs")
+        _status.update(
+            running=False,
+            current_job=None,
+            jobs_completed=_status["jobs_completed"] + 1,
+            last_finished_at=time.time(),
+            last_duration_seconds=round(duration, 3),
+        )
+
+async def watch_rag_files():
+    """Background task that queues changed files in rag/files for ingestion."""
+    try:
+        from watchfiles import awatch
+    except ImportError:
+        print("[RAG] watchfiles is not installed; new files are only ingested on restart.")
+        return
+    if not os.path.isdir(rag_system.FILES_DIR):
+        print(f"[RAG] Not watching '{rag_system.FILES_DIR}': directory does not exist.")
+        return
+
+    files_dir = os.path.realpath(rag_system.FILES_DIR)
+    _status["watching"] = True
+    print(f"[RAG] Watching {rag_system.FILES_DIR} for changes.")
+    try:
+        async for changes in awatch(rag_system.FILES_DIR, debounce=RAG_WATCH_DEBOUNCE_MS, recursive=False):
+            # Only files directly in the directory are ingested, under the same paths as a full scan
+            paths = {
+                os.path.join(rag_system.FILES_DIR, os.path.basename(path))
+                for _, path in changes
+                if os.path.realpath(os.path.dirname(path)) == files_dir
+            }
+            if paths:
+                print(f"[RAG] {len(paths)} files changed; queued for ingestion.")
+                enqueue(paths)
+    finally:
+        _status["watching"] = False
@@ -17,8 +17,8 @@ async def tweet_generator(app: FastAPI):
             being = app.state.being
             # Use a consistent prompt
             prompt = "tweet something in the style of your personality, do not repeat recent tweets"
-            rag_context = search_rag(prompt, top_k=3)
-            response = get_ai_response(being, rag_context, prompt)
+            rag_context = await asyncio.to_thread(search_rag, prompt, top_k=3)
+            response = await get_ai_response(being, rag_context, prompt)
 
             print(f"Generated Tweet: {response}")
 
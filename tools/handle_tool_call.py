@@ -1,13 +1,51 @@
 import re
 import ast
+import json
 import sys
 import os
+import asyncio
+import inspect
 
 # Import get_tool_function to retrieve the actual callable tool function
-from tools.tool_registry import get_tool_function
+from tools.tool_registry import get_tool_function, get_tool_schema
 
-# Regex to match FUNCTION: <tool_name> PARAMS: { ... }
-TOOL_CALL_REGEX = r"FUNCTION:\s*(\w+)\s*PARAMS:\s*(\{.*?\})"
+# Regex to match the FUNCTION: <tool_name> PARAMS: header; the {...} body is scanned separately
+TOOL_CALL_HEADER_REGEX = r"FUNCTION:\s*(\w+)\s*PARAMS:\s*(?=\{)"
+
+def _extract_braced(text: str, start: int):
+    """
+    Returns the balanced {...} block starting at text[start], or None if it never closes.
+    Braces inside quoted strings are ignored, so nested dicts and values like "{x}" survive.
+    """
+    depth = 0
+    quote = None
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+    return None
+
+def _parse_params(params_str: str):
+    """Parses tool params written as JSON or as a Python dict literal."""
+    try:
+        return json.loads(params_str)
+    except json.JSONDecodeError:
+        # Safely evaluate the params dict string
+        return ast.literal_eval(params_str)
 
 def is_tool_call(message: str):
     """
@@ -18,15 +56,15 @@ def is_tool_call(message: str):
     - List of tuples [(tool_name, params), ...] if tool calls found
     - False if no tool calls found
     """
-    matches = re.findall(TOOL_CALL_REGEX, message, re.DOTALL)
-    if not matches:
-        return False
-    
     tool_calls = []
-    for tool_name, params_str in matches:
+    for match in re.finditer(TOOL_CALL_HEADER_REGEX, message):
+        tool_name = match.group(1)
+        params_str = _extract_braced(message, match.end())
+        if params_str is None:
+            print(f"[ERROR] Failed to parse tool call parameters for '{tool_name}': unbalanced braces")
+            continue
         try:
-            # Safely evaluate the params dict string
-            params = ast.literal_eval(params_str)
+            params = _parse_params(params_str)
             # Ensure params is actually a dictionary
             if not isinstance(params, dict):
                 print(f"[WARNING] Parsed parameters for '{tool_name}' are not a dictionary: {params}")
@@ -38,6 +76,24 @@ def is_tool_call(message: str):
     
     return tool_calls if tool_calls else False
 
+def format_tool_call(tool_name: str, params: dict) -> str:
+    """Renders a structured tool call in the text protocol, e.g. for storing in history."""
+    return f"FUNCTION: {tool_name} PARAMS: {json.dumps(params)}"
+
+def normalize_tool_params(tool_name: str, params: dict) -> dict:
+    """
+    Coerces structured tool arguments to the tool's declared types.
+    Some providers (Gemini) send every number as a float, which breaks int parameters.
+    """
+    schema = get_tool_schema(tool_name) or {}
+    properties = schema.get("parameters", {}).get("properties", {})
+    normalized = {}
+    for name, value in params.items():
+        if properties.get(name, {}).get("type") == "integer" and isinstance(value, float) and value.is_integer():
+            value = int(value)
+        normalized[name] = value
+    return normalized
+
 def parse_tool_call(message: str):
     """
     LEGACY FUNCTION: Maintains backward compatibility.
@@ -90,4 +146,41 @@ def run_tools_batch(tool_calls):
     for tool_name, params in tool_calls:
         result = run_tool(tool_name, params)
         results.append(result)
-    return results
\ No newline at end of file
+    return results
+
+async def run_tool_async(tool_name: str, params: dict):
+    """
+    Awaitable version of run_tool.
+    Coroutine tools are awaited directly; regular tools run in a worker thread
+    so blocking I/O (HTTP calls, file access) does not stall the event loop.
+    """
+    tool_function = get_tool_function(tool_name)
+
+    if tool_function is None:
+        return f"Tool '{tool_name}' not found in registry or is not a callable function."
+
+    if not inspect.iscoroutinefunction(tool_function):
+        return await asyncio.to_thread(run_tool, tool_name, params)
+
+    try:
+        result = await tool_function(**params)
+        print(f"[TOOL EXECUTION] Successfully ran '{tool_name}' with params {params}. Result: {result}")
+        return result
+    except TypeError as e:
+        print(f"[ERROR] Error executing tool '{tool_name}': Invalid parameters or missing required arguments. Details: {e}")
+        return f"Error executing tool '{tool_name}': Invalid parameters or missing required arguments. Ensure all required parameters are provided and are of the correct type. Details: {e}"
+    except Exception as e:
+        print(f"[ERROR] An unexpected error occurred while running tool '{tool_name}': {e}")
+        return f"An unexpected error occurred while running tool '{tool_name}': {e}"
+
+async def run_tools_batch_async(tool_calls):
+    """
+    Executes multiple tools concurrently.
+
+    Args:
+        tool_calls: List of tuples [(tool_name, params), ...]
+
+    Returns:
+        List of results in the same order as tool_calls
+    """
+    return list(await asyncio.gather(*(run_tool_async(tool_name, params) for tool_name, params in tool_calls)))
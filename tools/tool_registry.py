@@ -42,4 +42,8 @@ def get_tool_schema(tool_name: str):
 
 def get_all_tool_schemas():
     """Returns a list of all registered tool schemas."""
-    return [info["schema"] for info in TOOL_REGISTRY.values()]
\ No newline at end of file
+    return [info["schema"] for info in TOOL_REGISTRY.values()]
+
+def get_tool_schemas(tool_names):
+    """Returns the schemas of the given registered tools, skipping unknown names."""
+    return [TOOL_REGISTRY[name]["schema"] for name in tool_names if isinstance(name, str) and name in TOOL_REGISTRY]
\ No newline at end of file
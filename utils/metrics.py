@@ -0,0 +1,39 @@
+import threading
+from collections import defaultdict
+
+# In-process counters and observations, exposed through GET /metrics.
+# Worker threads update these too (asyncio.to_thread), hence the lock.
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_observations = {}
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+def observe(name, value):
+    """Records a sample; keeps count, sum, min, max and the last value."""
+    with _lock:
+        stats = _observations.get(name)
+        if stats is None:
+            _observations[name] = {"count": 1, "sum": value, "min": value, "max": value, "last": value}
+            return
+        stats["count"] += 1
+        stats["sum"] += value
+        stats["min"] = min(stats["min"], value)
+        stats["max"] = max(stats["max"], value)
+        stats["last"] = value
+
+def snapshot():
+    with _lock:
+        observations = {
+            name: {**stats, "avg": stats["sum"] / stats["count"]}
+            for name, stats in _observations.items()
+        }
+        return {"counters": dict(_counters), "observations": observations}
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _observations.clear()
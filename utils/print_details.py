@@ -5,6 +5,7 @@ def print_being_details(being):
     
     print("\n" + "-"*20 + " PROVIDER " + "-"*20)
     print(f"Model Provider: {being['modelProvider']}")
+    print(f"Fallback Providers: {being.get('fallbackProviders') or 'None'}")
     print(f"System Prompt: {being['system']}")
     
     print("\n" + "-"*20 + " CHARACTER " + "-"*20)
@@ -0,0 +1,26 @@
+import time
+from contextlib import contextmanager
+
+from utils import metrics
+
+# Seconds spent per startup step (imports, database, RAG model...), in the order they ran.
+# Also recorded as startup.<step>_seconds observations in GET /metrics.
+_timings = {}
+
+def record(name, seconds):
+    _timings[name] = seconds
+    metrics.observe(f"startup.{name}_seconds", seconds)
+
+@contextmanager
+def timed(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+def timings():
+    return dict(list(_timings.items()))
+
+def format_report():
+    return ", ".join(f"{name}={seconds:.2f}s" for name, seconds in list(_timings.items()))